@@ -0,0 +1,125 @@
+import array
+import io
+import os
+import pickle
+import random
+import zlib
+from typing import Any
+
+MAGIC = b'MUNCHCKP'
+FORMAT_VERSION = 2
+
+
+class CheckpointPickler(pickle.Pickler):
+
+    def __init__(self, file: io.BytesIO, node_class: type) -> None:
+        """
+        Creates a pickler that writes every instance of node_class as a reference to its MAC address rather than in
+        place, so that pickling a node never recurses into its neighbors, and their neighbors, across the whole mesh.
+        The random module, which objects fall back to drawing from, is also written as a reference.
+        """
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.node_class: type = node_class
+        self.uses_random_module: bool = False
+
+    def persistent_id(self, obj: Any) -> Any:
+        """
+        Returns the reference obj is written as, or None to pickle it normally.
+        """
+        if obj is random:
+            self.uses_random_module = True
+            return ('random',)
+        if type(obj) is self.node_class:
+            return ('node', obj.get_mac())
+        return None
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+
+    def __init__(self, file: io.BytesIO, node_class: type) -> None:
+        """
+        Creates an unpickler that resolves the references written by CheckpointPickler. Nodes are created empty on
+        their first reference, and have their state filled in once everything has been read.
+        """
+        super().__init__(file)
+        self.node_class: type = node_class
+        self.nodes: dict[str, Any] = {}
+
+    def persistent_load(self, pid: Any) -> Any:
+        """
+        Returns the object that the reference pid stands for.
+        """
+        if pid == ('random',):
+            return random
+        if pid[0] == 'node':
+            if pid[1] not in self.nodes:
+                self.nodes[pid[1]] = self.node_class.__new__(self.node_class)
+            return self.nodes[pid[1]]
+        raise pickle.UnpicklingError(f'unknown checkpoint reference {pid}')
+
+
+def write_checkpoint(arena: Any, node_class: type, path: str) -> None:
+    """
+    Writes the whole state of arena, whose nodes are instances of node_class, to path.
+
+    The file is an 8-byte magic string, the format version, and then a zlib-compressed pickle of the arena's
+    attributes and every node's attributes. Random generators are pickled with their state, and if anything draws
+    from the random module, its state is saved too. The file is written to a temporary path and renamed, so a crash
+    while saving never leaves a truncated checkpoint behind.
+    """
+    buffer = io.BytesIO()
+    pickler = CheckpointPickler(buffer, node_class)
+    nodes = {mac: node.__dict__ for mac, node in arena.node_dict.items()}
+    pickler.dump((type(arena), arena.__dict__, nodes))
+    # the random module's state only matters if something referenced it, which is only known after pickling
+    pickler.dump(random.getstate() if pickler.uses_random_module else None)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(array.array('I', [FORMAT_VERSION]).tobytes())
+        f.write(zlib.compress(buffer.getvalue()))
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str, node_class: type) -> Any:
+    """
+    Reads a checkpoint written by write_checkpoint for an arena whose nodes are instances of node_class, and returns
+    the restored arena. If the checkpointed arena drew from the random module, that module's state is restored.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a checkpoint')
+    version = array.array('I', data[len(MAGIC):len(MAGIC) + 4])[0]
+    if version != FORMAT_VERSION:
+        raise ValueError(f'{path} has format version {version}, expected {FORMAT_VERSION}')
+
+    unpickler = CheckpointUnpickler(io.BytesIO(zlib.decompress(data[len(MAGIC) + 4:])), node_class)
+    arena_class, arena_state, nodes = unpickler.load()
+    random_state = unpickler.load()
+
+    arena = arena_class.__new__(arena_class)
+    arena.__dict__.update(arena_state)
+    for mac, node_state in nodes.items():
+        node = unpickler.persistent_load(('node', mac))
+        node.__dict__.update(node_state)
+    if random_state is not None:
+        random.setstate(random_state)
+    return arena
+
+
+def get_resumed(name: str, saved: Any, passed: Any, attribute: str) -> Any:
+    """
+    Returns the name object, such as the traffic model, that a simulation should use, given the one saved in its
+    arena (None unless the arena was loaded from a checkpoint mid-run) and the one passed to simulate. A saved object
+    carries on from where the checkpoint left it, so it is kept, and one passed again is only checked against it: it
+    must be of the same class and have the same value of attribute, if it has one.
+    """
+    if saved is None or passed is None:
+        return passed if saved is None else saved
+    if type(passed) is not type(saved) or getattr(passed, attribute, None) != getattr(saved, attribute, None):
+        raise ValueError(f'{name} {type(passed).__name__} with {attribute} {getattr(passed, attribute, None)!r} does '
+                         f'not match the checkpointed {type(saved).__name__} with {attribute} '
+                         f'{getattr(saved, attribute, None)!r}')
+    return saved
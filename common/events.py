@@ -0,0 +1,51 @@
+import heapq
+from typing import Any
+
+
+class EventCalendar:
+
+    def __init__(self) -> None:
+        """
+        Creates an empty calendar of the timesteps at which nodes have timed work to do, such as a response becoming
+        due or packets in their pool expiring.
+
+        Each timestep holds, for every node with work at it, the list of payloads (e.g. response packets) scheduled
+        for that node, and a heap of timesteps gives the next one. Only due timesteps are ever touched, and any number
+        of payloads can be scheduled for the same node and timestep.
+        """
+        self.events: dict[int, dict[str, list[Any]]] = {}
+        self.times: list[int] = []
+
+    def schedule(self, timestep: int, mac: str, payload: Any = None) -> None:
+        """
+        Records that mac has work to do at timestep, carrying payload if one is given.
+        """
+        if timestep not in self.events:
+            self.events[timestep] = {}
+            heapq.heappush(self.times, timestep)
+        payloads = self.events[timestep].setdefault(mac, [])
+        if payload is not None:
+            payloads.append(payload)
+
+    def pop(self, timestep: int) -> dict[str, list[Any]]:
+        """
+        Removes every event at or before timestep, and returns a mapping of the nodes they were for to their
+        payloads, in the order they were scheduled.
+        """
+        due = {}
+        while self.times and self.times[0] <= timestep:
+            for mac, payloads in self.events.pop(heapq.heappop(self.times)).items():
+                due.setdefault(mac, []).extend(payloads)
+        return due
+
+    def next_timestep(self) -> int or None:
+        """
+        Returns the earliest timestep with work scheduled, or None if there is none.
+        """
+        return self.times[0] if self.times else None
+
+    def __len__(self) -> int:
+        """
+        Returns the number of timesteps with work scheduled
+        """
+        return len(self.times)
@@ -0,0 +1,163 @@
+class LatencyHistogram:
+
+    def __init__(self, precision_bits: int = 7) -> None:
+        """
+        Creates an empty histogram of non-negative integer latencies, in memory that only grows with the logarithm of
+        the largest latency rather than with the number of latencies.
+
+        Latencies below 2 ** precision_bits are counted exactly. Larger ones share a bucket with latencies that agree
+        on their top precision_bits + 1 bits, so percentiles are within 2 ** -(precision_bits + 1) of the truth
+        (under half a percent by default). The count, sum, minimum and maximum are kept exactly.
+        """
+        self.precision_bits: int = precision_bits
+        # mapping of the smallest latency a bucket holds to the number of latencies in it
+        self.buckets: dict[int, int] = {}
+        self.count: int = 0
+        self.total: int = 0
+        self.min: float = float('inf')
+        self.max: float = float('-inf')
+
+    def get_bucket(self, latency: int) -> tuple[int, int]:
+        """
+        Returns the smallest and largest latency of the bucket that latency falls in.
+        """
+        shift = max(int(latency).bit_length() - self.precision_bits - 1, 0)
+        low = int(latency) >> shift << shift
+        return low, low + (1 << shift) - 1
+
+    def add(self, latency: int) -> None:
+        """
+        Records one latency.
+        """
+        low, _ = self.get_bucket(latency)
+        self.buckets[low] = self.buckets.get(low, 0) + 1
+        self.count += 1
+        self.total += latency
+        self.min = min(self.min, latency)
+        self.max = max(self.max, latency)
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        """
+        Adds every latency recorded in other, which must have the same precision, to this histogram.
+        """
+        if other.precision_bits != self.precision_bits:
+            raise ValueError('can only merge histograms of the same precision')
+        for low, count in other.buckets.items():
+            self.buckets[low] = self.buckets.get(low, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def get_mean(self) -> float:
+        """
+        Returns the exact mean latency, or infinity if none were recorded.
+        """
+        return self.total / self.count if self.count > 0 else float('inf')
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Returns the latency that percentile percent of the recorded latencies are at or below, or infinity if none
+        were recorded. Latencies in a shared bucket are reported as the middle of the bucket.
+        """
+        if self.count == 0:
+            return float('inf')
+        # the rank, counting from 1, of the latency to report
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for low in sorted(self.buckets):
+            seen += self.buckets[low]
+            if seen >= rank:
+                _, high = self.get_bucket(low)
+                return min(max((low + high) / 2, self.min), self.max)
+        return self.max
+
+
+class PacketMetrics:
+
+    def __init__(self, counters: 'NetworkCounters' = None) -> None:
+        """
+        Creates the metrics of the packets a node originates. Completed packets are also counted in counters, if given.
+
+        Only packets still waiting for their response are tracked individually, with the timestep they were sent at.
+        A packet leaves that table as soon as it completes, and is counted into a success counter and a latency
+        histogram, so memory is bounded by the packets in flight rather than growing with the length of the run.
+        Packets still in flight when the metrics are read count as drops.
+        """
+        self.sent: int = 0
+        self.successes: int = 0
+        # mapping of the ids of packets that are waiting for their response to the timestep they were sent at
+        self.in_flight: dict[int, int] = {}
+        self.latency: LatencyHistogram = LatencyHistogram()
+        self.counters: NetworkCounters or None = counters
+
+    def record_sent(self, packet_id: int, timestep: int) -> None:
+        """
+        Records that the packet packet_id was sent at timestep.
+        """
+        self.sent += 1
+        self.in_flight[packet_id] = timestep
+
+    def record_received(self, packet_id: int, timestep: int) -> None:
+        """
+        Records that the response to packet_id arrived at timestep. Responses to packets that are not in flight,
+        such as duplicates, are ignored.
+        """
+        sent_at = self.in_flight.pop(packet_id, None)
+        if sent_at is not None:
+            self.successes += 1
+            self.latency.add(timestep - sent_at)
+            if self.counters is not None:
+                self.counters.completed += 1
+
+    def is_in_flight(self, packet_id: int) -> bool:
+        """
+        Returns True iff packet_id was sent and its response has not arrived yet.
+        """
+        return packet_id in self.in_flight
+
+    def get_drops(self) -> int:
+        """
+        Returns the number of packets sent that have not completed
+        """
+        return self.sent - self.successes
+
+    def get_summary(self) -> dict[str, float]:
+        """
+        Returns the successes, drops, and mean and p50, p95 and p99 latency of the packets sent. Latencies are
+        infinite if no packet completed.
+        """
+        return {
+            'successes': self.successes,
+            'drops': self.get_drops(),
+            'average_latency': self.latency.get_mean(),
+            'latency_p50': self.latency.get_percentile(50),
+            'latency_p95': self.latency.get_percentile(95),
+            'latency_p99': self.latency.get_percentile(99),
+        }
+
+
+class NetworkCounters:
+
+    def __init__(self) -> None:
+        """
+        Creates running totals of what happens across every node of an arena. Nodes add to them as things happen, so
+        that the arena can read network-wide totals at any time without visiting every node.
+        """
+        # packets queued at nodes right now
+        self.queued: int = 0
+        # transmissions nodes attempted, and how many of them were lost to hidden terminals
+        self.sends: int = 0
+        self.hidden_terminal_sends: int = 0
+        # packets sent that their next hop did not hear
+        self.link_drops: int = 0
+        # packets whose response made it back to where they were sent from
+        self.completed: int = 0
+        # transmissions that coded several packets together
+        self.coded_packets: int = 0
+
+    def get_totals(self) -> tuple[int, int, int, int, int]:
+        """
+        Returns the totals of sends, hidden terminal sends, link drops, completed packets and coded packets.
+        """
+        return self.sends, self.hidden_terminal_sends, self.link_drops, self.completed, self.coded_packets
@@ -0,0 +1,167 @@
+import heapq
+import math
+
+from .topology import Topology
+
+
+class Route:
+
+    def __init__(self, hops: tuple[str, ...]) -> None:
+        """
+        Creates an immutable route through the given MAC addresses, from hops[0] to hops[-1].
+
+        Routes are shared by every packet sent along them instead of each packet carrying its own copy of the path,
+        and each route keeps a position index so that finding a node's nexthop is a dict lookup rather than a scan.
+        """
+        self.hops: tuple[str, ...] = hops
+        self.positions: dict[str, int] = {mac: i for i, mac in enumerate(hops)}
+        self.reverse: "Route" = None
+
+    def get_src(self) -> str:
+        """
+        Returns the first node on this route
+        """
+        return self.hops[0]
+
+    def get_dst(self) -> str:
+        """
+        Returns the last node on this route
+        """
+        return self.hops[-1]
+
+    def get_nexthop(self, mac: str) -> str:
+        """
+        Returns the node after mac on this route.
+        """
+        return self.hops[self.positions[mac] + 1]
+
+    def get_reverse(self) -> "Route":
+        """
+        Returns this route walked backwards. The reverse is built once and then shared.
+        """
+        if self.reverse is None:
+            self.reverse = Route(self.hops[::-1])
+            self.reverse.reverse = self
+        return self.reverse
+
+    def __contains__(self, mac: str) -> bool:
+        """
+        Returns True iff mac is on this route
+        """
+        return mac in self.positions
+
+    def __len__(self) -> int:
+        """
+        Returns the number of nodes on this route
+        """
+        return len(self.hops)
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Returns True iff two routes visit the same nodes in the same order
+        """
+        return isinstance(other, Route) and self.hops == other.hops
+
+    def __hash__(self) -> int:
+        """
+        Hashes a route by its hops
+        """
+        return hash(self.hops)
+
+    def __repr__(self) -> str:
+        """
+        Returns Route representation
+        """
+        return f'Route({list(self.hops)})'
+
+
+class RoutingEngine:
+
+    def __init__(self, topology: Topology) -> None:
+        """
+        Creates a routing engine over the links of topology.
+
+        Routes maximize the product of link success probabilities. Internally this is a shortest path problem over
+        additive -log(p) weights, solved once per destination as a reverse shortest-path tree. Links are symmetric,
+        so the tree towards a destination gives every node's best nexthop to it, and a route is just a walk up the
+        tree.
+        """
+        self.topology: Topology = topology
+        self.index: dict[str, int] = {mac: i for i, mac in enumerate(topology.macs)}
+        self.weights: list[float] = [-math.log(p) if p > 0 else float('inf')
+                                     for p in topology.probabilities]
+
+        # mapping of destination index to the nexthop index of every node towards it (-1 if unreachable)
+        self.trees: dict[int, list[int]] = {}
+        # mapping of (src, dst) to the route shared by every packet sent between them
+        self.routes: dict[tuple[str, str], Route] = {}
+
+    def get_tree(self, dst: str) -> list[int]:
+        """
+        Returns the nexthop towards dst of every node, by index, computing the tree the first time dst is asked for.
+
+        dst is its own nexthop, and nodes that cannot reach dst have nexthop -1.
+        """
+        dst_index = self.index[dst]
+        if dst_index in self.trees:
+            return self.trees[dst_index]
+
+        topology = self.topology
+        indptr, indices, weights = topology.indptr, topology.indices, self.weights
+        distances = [float('inf')] * topology.num_nodes()
+        nexthops = [-1] * topology.num_nodes()
+        distances[dst_index] = 0
+        nexthops[dst_index] = dst_index
+
+        priority_queue = [(0, dst_index)]
+        while priority_queue:
+            current_distance, current = heapq.heappop(priority_queue)
+            if current_distance > distances[current]:
+                continue
+
+            for slot in range(indptr[current], indptr[current + 1]):
+                new_distance = current_distance + weights[slot]
+                neighbor = indices[slot]
+                if new_distance < distances[neighbor]:
+                    distances[neighbor] = new_distance
+                    nexthops[neighbor] = current
+                    heapq.heappush(priority_queue, (new_distance, neighbor))
+
+        self.trees[dst_index] = nexthops
+        return nexthops
+
+    def precompute(self, dsts: list[str]) -> None:
+        """
+        Builds the trees towards every destination in dsts up front, e.g. for all internet enabled nodes.
+        """
+        for dst in dsts:
+            self.get_tree(dst)
+
+    def get_route(self, src: str, dst: str) -> Route:
+        """
+        Returns the shared Route object for the most reliable path from src to dst.
+
+        Raises a ValueError if dst can not be reached from src.
+        """
+        if (src, dst) not in self.routes:
+            self.routes[(src, dst)] = Route(tuple(self.get_path(src, dst)))
+        return self.routes[(src, dst)]
+
+    def get_path(self, src: str, dst: str) -> list[str]:
+        """
+        Returns the most reliable path from src to dst, inclusive of both ends.
+
+        Raises a ValueError if dst can not be reached from src.
+        """
+        nexthops = self.get_tree(dst)
+        macs = self.topology.macs
+        current = self.index[src]
+        if nexthops[current] == -1:
+            raise ValueError(f'no route from {src} to {dst}')
+
+        path = [src]
+        dst_index = self.index[dst]
+        while current != dst_index:
+            current = nexthops[current]
+            path.append(macs[current])
+        return path
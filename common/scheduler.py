@@ -0,0 +1,70 @@
+import heapq
+
+
+class RoundRobinScheduler:
+
+    def __init__(self, macs: list[str]) -> None:
+        """
+        Creates a round-robin scheduler over the given MAC addresses, which start out in the given order.
+
+        Every node has a rank, and the fairness order is increasing rank, so moving a node to the back is just giving
+        it the next unused rank. Only nodes that have been marked ready are visited. Nodes mark themselves ready when
+        they get something to send, and can also ask to be woken at a later timestep. Every node starts out ready.
+        """
+        self.ranks: dict[str, int] = {mac: rank for rank, mac in enumerate(macs)}
+        self.next_rank: int = len(macs)
+        self.ready: set[str] = set(macs)
+        # heap of (timestep, mac) for nodes that asked to be woken at a timestep
+        self.wakeups: list[tuple[int, str]] = []
+
+    def mark_ready(self, mac: str) -> None:
+        """
+        Marks mac as having something to send.
+        """
+        self.ready.add(mac)
+
+    def wake_at(self, mac: str, timestep: float) -> None:
+        """
+        Marks mac as ready once timestep is reached. Timesteps that will never come are ignored.
+        """
+        if timestep != float('inf'):
+            heapq.heappush(self.wakeups, (timestep, mac))
+
+    def discard(self, mac: str) -> None:
+        """
+        Marks mac as having nothing to send, until it is marked ready again.
+        """
+        self.ready.discard(mac)
+
+    def move_to_back(self, mac: str) -> None:
+        """
+        Moves mac behind every other node in the fairness order.
+        """
+        self.ranks[mac] = self.next_rank
+        self.next_rank += 1
+
+    def get_ready(self, timestep: int) -> list[str]:
+        """
+        Returns the nodes that are ready at timestep, in fairness order.
+        """
+        while self.wakeups and self.wakeups[0][0] <= timestep:
+            self.ready.add(heapq.heappop(self.wakeups)[1])
+        return sorted(self.ready, key=self.ranks.__getitem__)
+
+    def has_ready(self, timestep: int) -> bool:
+        """
+        Returns True iff some node is ready at timestep.
+        """
+        return bool(self.ready) or bool(self.wakeups and self.wakeups[0][0] <= timestep)
+
+    def next_wakeup(self) -> int or None:
+        """
+        Returns the earliest timestep a node asked to be woken at, or None if there is none.
+        """
+        return self.wakeups[0][0] if self.wakeups else None
+
+    def get_order(self) -> list[str]:
+        """
+        Returns every node in fairness order, ready or not.
+        """
+        return sorted(self.ranks, key=self.ranks.__getitem__)
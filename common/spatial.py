@@ -0,0 +1,62 @@
+import math
+
+
+class SpatialGrid:
+
+    def __init__(self, cell_size: float) -> None:
+        """
+        Creates an empty uniform grid that buckets points into square cells of side cell_size.
+
+        Items are returned from queries in the order they were inserted, so that callers iterating over
+        candidates see them in the same order as a scan over the original list would.
+        """
+        assert cell_size > 0, 'cell size of a spatial grid must be positive'
+        self.cell_size: float = cell_size
+        self.cells: dict[tuple[int, int], list[tuple[int, object]]] = {}
+        self.num_items: int = 0
+
+    def insert(self, x: float, y: float, item: object) -> None:
+        """
+        Inserts item at position (x, y).
+        """
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        self.cells.setdefault(cell, []).append((self.num_items, item))
+        self.num_items += 1
+
+    def query(self, x: float, y: float, radius: float) -> list[object]:
+        """
+        Returns every item whose cell overlaps the square of half-width radius centered at (x, y), in insertion order.
+
+        This is a superset of the items within Euclidean distance radius of (x, y); callers are expected to do the exact
+        distance check themselves.
+        """
+        if radius == float('inf'):
+            cells = list(self.cells.values())
+        else:
+            min_cx = math.floor((x - radius) / self.cell_size)
+            max_cx = math.floor((x + radius) / self.cell_size)
+            min_cy = math.floor((y - radius) / self.cell_size)
+            max_cy = math.floor((y + radius) / self.cell_size)
+
+            # a huge radius can span more cells than are occupied, so just walk the occupied ones
+            if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self.cells):
+                cells = [items for (cx, cy), items in self.cells.items()
+                         if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+            else:
+                cells = []
+                for cx in range(min_cx, max_cx + 1):
+                    for cy in range(min_cy, max_cy + 1):
+                        if (cx, cy) in self.cells:
+                            cells.append(self.cells[(cx, cy)])
+
+        if len(cells) == 1:
+            return [item for _, item in cells[0]]
+        candidates = [entry for items in cells for entry in items]
+        candidates.sort(key=lambda entry: entry[0])
+        return [item for _, item in candidates]
+
+    def __len__(self) -> int:
+        """
+        Returns the number of items in the grid
+        """
+        return self.num_items
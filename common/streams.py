@@ -0,0 +1,36 @@
+import random
+
+# the independent random streams an arena draws from
+STREAMS = ('traffic', 'links', 'mac')
+
+
+class RandomStreams:
+
+    def __init__(self, seed: int = None) -> None:
+        """
+        Creates one random generator per name in STREAMS, each seeded from seed and the stream's name, so that, e.g.,
+        drawing more traffic does not shift which transmissions are lost.
+
+        The streams only depend on seed, so two arenas with the same seed draw identical numbers no matter what else
+        runs in the process. If seed is not given, one is drawn from the random module, so seeding that first still
+        reproduces a run.
+        """
+        self.seed: int = random.getrandbits(64) if seed is None else seed
+        self.traffic: random.Random = random.Random(f'{self.seed}:traffic')
+        self.links: random.Random = random.Random(f'{self.seed}:links')
+        self.mac: random.Random = random.Random(f'{self.seed}:mac')
+
+    def get_stream(self, name: str) -> random.Random:
+        """
+        Returns the generator of the stream called name, one of STREAMS.
+        """
+        if name not in STREAMS:
+            raise ValueError(
+                f'unknown random stream {name}, expected one of {STREAMS}')
+        return getattr(self, name)
+
+    def get_seed(self) -> int:
+        """
+        Returns the seed the streams were created from
+        """
+        return self.seed
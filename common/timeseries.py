@@ -0,0 +1,141 @@
+import array
+import ast
+import os
+import sys
+
+# the columns a recorder writes. queue_backlog is sampled when a row is written, and the other series after timestep
+# are summed over the timesteps since the previous row
+SERIES = ('timestep', 'queue_backlog', 'senders', 'hidden_terminals', 'link_drops', 'completed', 'coded_packets')
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# every column file has a header of this many bytes, so that it can be rewritten in place as rows are appended
+NPY_HEADER_SIZE = 128
+
+
+def make_npy_header(rows: int) -> bytes:
+    """
+    Returns the header of a .npy file holding a one-dimensional array of rows little-endian 64-bit integers, padded
+    to NPY_HEADER_SIZE bytes.
+    """
+    header = f"{{'descr': '<i8', 'fortran_order': False, 'shape': ({rows},), }}"
+    header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - 1) + '\n'
+    return NPY_MAGIC + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+def read_npy_rows(path: str) -> int:
+    """
+    Returns the number of rows in the header of the column file at path.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(NPY_HEADER_SIZE)
+    if header[:len(NPY_MAGIC)] != NPY_MAGIC:
+        raise ValueError(f'{path} is not a time series column')
+    return ast.literal_eval(header[len(NPY_MAGIC) + 2:].decode('latin1'))['shape'][0]
+
+
+def read_timeseries(directory: str) -> dict[str, array.array]:
+    """
+    Returns every column written to directory by a TimeSeriesRecorder, keyed by its name in SERIES. The files are
+    plain .npy files, so numpy.load, with mmap_mode='r' for long runs, reads them too.
+    """
+    columns = {}
+    for name in SERIES:
+        path = os.path.join(directory, f'{name}.npy')
+        rows = read_npy_rows(path)
+        column = array.array('q')
+        with open(path, 'rb') as f:
+            f.seek(NPY_HEADER_SIZE)
+            column.frombytes(f.read(rows * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns[name] = column
+    return columns
+
+
+class TimeSeriesRecorder:
+
+    def __init__(self, directory: str, stride: int = 1, buffer_rows: int = 4096) -> None:
+        """
+        Creates a recorder that writes the time series in SERIES to directory, one .npy file per column, with a row
+        every stride timesteps. Rows are buffered in memory, buffer_rows at a time, and then appended to the column
+        files, whose headers are rewritten in place to cover the new rows. Data is written before headers, so a run
+        that is killed leaves files that hold every row that was flushed.
+
+        Timesteps an event-driven arena skips are folded into the next row written, so the timestep column, the
+        number of timesteps run when each row was written, is not always a multiple of stride.
+
+        Existing files in directory are overwritten. The recorder holds no open files, so it can be pickled into a
+        checkpoint and carry on later, in which case its next flush overwrites any rows written after the checkpoint.
+        """
+        if stride < 1:
+            raise ValueError(f'stride must be at least 1, got {stride}')
+        self.directory: str = directory
+        self.stride: int = stride
+        self.buffer_rows: int = buffer_rows
+        self.buffers: dict[str, array.array] = {name: array.array('q') for name in SERIES}
+        # rows already in the files
+        self.rows: int = 0
+        # the timestep and cumulative counters of the last row, or None before the first sample
+        self.last_timestep: int or None = None
+        self.last_totals: tuple[int, ...] or None = None
+        self.next_sample: int = 0
+
+    def get_path(self, name: str) -> str:
+        """
+        Returns the path of the file column name is written to.
+        """
+        return os.path.join(self.directory, f'{name}.npy')
+
+    def is_due(self, timestep: int) -> bool:
+        """
+        Returns True iff a row should be recorded once timestep timesteps have run.
+        """
+        return timestep >= self.next_sample
+
+    def record(self, timestep: int, queue_backlog: int, totals: tuple[int, ...]) -> None:
+        """
+        Records a row for the state of the arena once timestep timesteps have run, given the packets queued and the
+        cumulative counts of the series after queue_backlog in SERIES. The first call only takes the counts as a
+        baseline, and calls at the timestep of the last row are ignored.
+        """
+        if self.last_totals is None:
+            os.makedirs(self.directory, exist_ok=True)
+            for name in SERIES:
+                with open(self.get_path(name), 'wb') as f:
+                    f.write(make_npy_header(0))
+        else:
+            if timestep <= self.last_timestep:
+                return
+            row = (timestep, queue_backlog) + tuple(total - last for total, last in zip(totals, self.last_totals))
+            for name, value in zip(SERIES, row):
+                self.buffers[name].append(value)
+            if len(self.buffers['timestep']) >= self.buffer_rows:
+                self.flush()
+        self.last_timestep = timestep
+        self.last_totals = totals
+        self.next_sample = (timestep // self.stride + 1) * self.stride
+
+    def flush(self) -> None:
+        """
+        Appends the buffered rows to the column files, after the rows this recorder has already written.
+        """
+        if self.last_totals is None:
+            return
+        rows = self.rows + len(self.buffers['timestep'])
+        for name, buffer in self.buffers.items():
+            if sys.byteorder == 'big':
+                buffer.byteswap()
+            with open(self.get_path(name), 'r+b') as f:
+                f.seek(NPY_HEADER_SIZE + self.rows * buffer.itemsize)
+                f.write(buffer.tobytes())
+                f.truncate()
+                f.seek(0)
+                f.write(make_npy_header(rows))
+            del buffer[:]
+        self.rows = rows
+
+    def close(self) -> None:
+        """
+        Flushes the buffered rows. The recorder holds no open files, so nothing else needs releasing.
+        """
+        self.flush()
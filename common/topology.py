@@ -0,0 +1,319 @@
+import array
+import hashlib
+import json
+import mmap
+import os
+import sys
+
+from .spatial import SpatialGrid
+
+# bump whenever the layout of a compiled topology changes, so stale cache entries are never read
+FORMAT_VERSION = 3
+MAGIC = b'MUNCHTOP'
+
+# (name, typecode) for every array stored in a compiled topology, in file order
+ARRAYS = [
+    ('x', 'd'),
+    ('y', 'd'),
+    ('hierarchy_index', 'i'),
+    ('indptr', 'q'),
+    ('indices', 'i'),
+    ('distances', 'd'),
+    ('probabilities', 'd'),
+    ('contention_indptr', 'q'),
+    ('contention_indices', 'i'),
+]
+
+
+class Topology:
+
+    def __init__(self, macs: list[str], hierarchies: list[str], strengths: list[float], settings: dict, arrays: dict) -> None:
+        """
+        Creates a topology, which is the geometry and link structure of an arena with no simulation state.
+
+        Nodes are identified by their index in macs, and are ordered by hierarchy class and then by their order in
+        the topology file. Links are stored as a CSR adjacency: the neighbors of node i are
+        indices[indptr[i]:indptr[i + 1]], in the same order that Node.add_link would have discovered them, and
+        distances and probabilities hold the matching per-link values.
+
+        Contention is stored the same way, in contention_indptr and contention_indices: two nodes contend for the
+        medium if either one is within transmit distance of the other, whether or not they are allowed to link.
+        """
+        self.macs: list[str] = macs
+        self.hierarchies: list[str] = hierarchies
+        self.strengths: list[float] = strengths
+        self.settings: dict = settings
+
+        self.x = arrays['x']
+        self.y = arrays['y']
+        self.hierarchy_index = arrays['hierarchy_index']
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+        self.distances = arrays['distances']
+        self.probabilities = arrays['probabilities']
+        self.contention_indptr = arrays['contention_indptr']
+        self.contention_indices = arrays['contention_indices']
+
+    def __getstate__(self) -> dict:
+        """
+        Returns the state to pickle, e.g. for a checkpoint. Arrays memory-mapped from a compiled file are copied out,
+        since the mapping itself can not be pickled.
+        """
+        state = dict(self.__dict__)
+        for name, typecode in ARRAYS:
+            if isinstance(state[name], memoryview):
+                state[name] = array.array(typecode, state[name])
+        return state
+
+    def num_nodes(self) -> int:
+        """
+        Returns the number of nodes in this topology
+        """
+        return len(self.macs)
+
+    def get_links(self, index: int) -> range:
+        """
+        Returns the range of link slots (into indices, distances and probabilities) belonging to node index.
+        """
+        return range(self.indptr[index], self.indptr[index + 1])
+
+    def get_contenders(self, index: int) -> list[int]:
+        """
+        Returns the indices of every node that contends with node index for the medium, in increasing order.
+        """
+        return list(self.contention_indices[self.contention_indptr[index]:self.contention_indptr[index + 1]])
+
+    def get_transmit_distance(self, index: int) -> float:
+        """
+        Returns the transmit distance of node index
+        """
+        return self.strengths[self.hierarchy_index[index]]
+
+
+def parse_topology(filename: str) -> Topology:
+    """
+    Parses a topology JSON file and computes its links.
+
+    Links follow the same rules as the arenas always have: two nodes link if their hierarchy classes are allowed to
+    connect and they are within the smaller of their two strengths of each other.
+    """
+    with open(filename, 'r') as f:
+        data = json.load(f)
+
+    data_rules = data['rules']
+    data_hierarchies = data['hierarchies']
+    settings = {k: v for k, v in data.items() if k not in (
+        'rules', 'hierarchies')}
+
+    # allowed classes are kept in the order the rules list them, not in a set, so that link order (and with it every
+    # seeded result) does not depend on string hashing
+    rules = {h: {} for h in data_hierarchies}
+    for t1, t2 in data_rules:
+        rules[t1][t2] = None
+        rules[t2][t1] = None
+
+    hierarchies = list(data_hierarchies)
+    strengths = [data_hierarchies[h]['strength'] for h in hierarchies]
+    macs, xs, ys, hierarchy_index = [], [], [], []
+    adjacency: list[list[tuple[int, float]]] = []
+
+    # mapping of finalized hierarchies to a spatial index over their node indices
+    grids: dict[str, SpatialGrid] = {}
+
+    for h_index, hierarchy in enumerate(hierarchies):
+        transmit_distance = strengths[h_index]
+        # only nodes in nearby cells can be in range, so bucket each class by its strength
+        grid = SpatialGrid(transmit_distance if transmit_distance > 0 else 1)
+        all_nodes = data_hierarchies[hierarchy]['nodes'][0]
+
+        for mac_addr, node_obj in all_nodes.items():
+            x = node_obj['x']
+            y = node_obj['y']
+            index = len(macs)
+            neighbors = []
+
+            for link_class in rules[hierarchy]:
+                # if linked to own class, check against the nodes of this class placed so far
+                if link_class == hierarchy:
+                    link_distance = transmit_distance
+                    candidates = grid.query(x, y, link_distance)
+
+                # otherwise, check amongst the already finalized hierarchy classes
+                elif link_class in grids:
+                    link_distance = min(
+                        transmit_distance, data_hierarchies[link_class]['strength'])
+                    candidates = grids[link_class].query(x, y, link_distance)
+                else:
+                    continue
+
+                for other in candidates:
+                    actual = ((x - xs[other]) ** 2 +
+                              (y - ys[other]) ** 2) ** 0.5
+                    if actual <= link_distance:
+                        neighbors.append((other, actual))
+                        adjacency[other].append((index, actual))
+
+            macs.append(mac_addr)
+            xs.append(x)
+            ys.append(y)
+            hierarchy_index.append(h_index)
+            adjacency.append(neighbors)
+            grid.insert(x, y, index)
+
+        grids[hierarchy] = grid
+
+    indptr, indices, distances, probabilities = [0], [], [], []
+    for index, neighbors in enumerate(adjacency):
+        for other, actual in neighbors:
+            transmit_range = min(strengths[hierarchy_index[index]],
+                                 strengths[hierarchy_index[other]])
+            indices.append(other)
+            distances.append(actual)
+            probabilities.append(max(1 - 0.8 * actual / transmit_range, 0))
+        indptr.append(len(indices))
+
+    contention_indptr, contention_indices = compute_contention(
+        xs, ys, [strengths[h] for h in hierarchy_index])
+
+    arrays = {'x': xs, 'y': ys, 'hierarchy_index': hierarchy_index, 'indptr': indptr,
+              'indices': indices, 'distances': distances, 'probabilities': probabilities,
+              'contention_indptr': contention_indptr, 'contention_indices': contention_indices}
+    return Topology(macs, hierarchies, strengths, settings, arrays)
+
+
+def compute_contention(xs: list[float], ys: list[float], transmit_distances: list[float]) -> tuple[list[int], list[int]]:
+    """
+    Returns the contention graph of the given nodes as a CSR adjacency (indptr, indices), with each node's
+    contenders in increasing order.
+
+    Nodes i and j contend if their distance is within the transmit distance of either one, which is exactly when
+    Node.in_range holds in one direction or the other. Such a pair is found from the end with the larger transmit
+    distance, so each node only looks within its own transmit distance, and only amongst nodes whose transmit
+    distance is no larger.
+
+    Nodes are bucketed by transmit distance, with a grid per distance whose cells are that distance wide, so that a
+    few long-range nodes do not make the cells that short-range nodes search hold most of the network.
+    """
+    grids: dict[float, SpatialGrid] = {}
+    for index, transmit_distance in enumerate(transmit_distances):
+        if transmit_distance not in grids:
+            grids[transmit_distance] = SpatialGrid(transmit_distance if 0 < transmit_distance < float('inf') else 1)
+        grids[transmit_distance].insert(xs[index], ys[index], index)
+
+    contenders: list[set[int]] = [set() for _ in xs]
+    for index, transmit_distance in enumerate(transmit_distances):
+        x, y = xs[index], ys[index]
+        for grid_distance, grid in grids.items():
+            if grid_distance > transmit_distance:
+                continue
+            for other in grid.query(x, y, transmit_distance):
+                if other != index and ((x - xs[other]) ** 2 + (y - ys[other]) ** 2) ** 0.5 <= transmit_distance:
+                    contenders[index].add(other)
+                    contenders[other].add(index)
+
+    indptr, indices = [0], []
+    for neighbors in contenders:
+        indices.extend(sorted(neighbors))
+        indptr.append(len(indices))
+    return indptr, indices
+
+
+def get_compiled_path(filename: str, cache_dir: str) -> str:
+    """
+    Returns the path in cache_dir that the compiled form of the topology file would be stored at.
+
+    The name is a hash of the file's contents, so editing a topology never serves a stale compiled copy.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{FORMAT_VERSION}:{sys.byteorder}:'.encode())
+    with open(filename, 'rb') as f:
+        digest.update(f.read())
+    return os.path.join(cache_dir, digest.hexdigest() + '.top')
+
+
+def write_compiled(topology: Topology, path: str) -> None:
+    """
+    Writes topology to path as a compiled binary artifact.
+
+    The file is an 8-byte magic string, a little header length, a JSON header holding the MAC addresses, hierarchy
+    classes and settings, and then each array in ARRAYS as raw machine values aligned to 8 bytes.
+    """
+    blobs = []
+    layout = []
+    for name, typecode in ARRAYS:
+        values = array.array(typecode, getattr(topology, name))
+        blobs.append(values.tobytes())
+        layout.append([name, typecode, len(values)])
+
+    header = json.dumps({
+        'macs': topology.macs,
+        'hierarchies': topology.hierarchies,
+        'strengths': topology.strengths,
+        'settings': topology.settings,
+        'layout': layout,
+    }).encode()
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(array.array('I', [FORMAT_VERSION, len(header)]).tobytes())
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+            f.write(b'\0' * (-len(blob) % 8))
+    # rename is atomic, so concurrent readers never see a partially written file
+    os.replace(tmp_path, path)
+
+
+def read_compiled(path: str) -> Topology:
+    """
+    Reads a compiled topology written by write_compiled.
+
+    The arrays are memory-mapped views into the file rather than copies, so loading costs little more than parsing
+    the header.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(buffer)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f'{path} is not a compiled topology')
+    version, header_length = view[len(MAGIC):len(MAGIC) + 8].cast('I')
+    if version != FORMAT_VERSION:
+        raise ValueError(f'{path} has format version {version}, expected {FORMAT_VERSION}')
+
+    offset = len(MAGIC) + 8
+    header = json.loads(bytes(view[offset:offset + header_length]))
+    offset += header_length
+
+    arrays = {}
+    for name, typecode, length in header['layout']:
+        size = array.array(typecode).itemsize * length
+        arrays[name] = view[offset:offset + size].cast(typecode)
+        offset += size + (-size % 8)
+
+    return Topology(header['macs'], header['hierarchies'], header['strengths'], header['settings'], arrays)
+
+
+def compile_topology(filename: str, cache_dir: str) -> str:
+    """
+    Compiles the topology file into cache_dir if it is not already there, and returns the compiled path.
+    """
+    path = get_compiled_path(filename, cache_dir)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        write_compiled(parse_topology(filename), path)
+    return path
+
+
+def load_topology(filename: str, cache_dir: str = None) -> Topology:
+    """
+    Loads the topology in filename.
+
+    If cache_dir is given, the topology is compiled into it on first use and read back from the compiled artifact
+    afterwards. Otherwise, the JSON file is parsed directly.
+    """
+    if cache_dir is None:
+        return parse_topology(filename)
+    return read_compiled(compile_topology(filename, cache_dir))
@@ -0,0 +1,336 @@
+import abc
+import gzip
+import heapq
+import math
+import random
+from typing import Iterator
+
+TRAFFIC_MODELS = ('bernoulli', 'poisson', 'onoff', 'trace')
+SIZE_DISTRIBUTIONS = ('uniform', 'pareto')
+
+
+class UniformSizes:
+
+    def __init__(self, min_size: int = 1, max_size: int = 1) -> None:
+        """
+        Creates a flow size distribution that is uniform over the integers from min_size to max_size inclusive.
+        """
+        self.min_size: int = min_size
+        self.max_size: int = max_size
+
+    def draw(self, rng: random.Random) -> int:
+        """
+        Returns a flow size drawn with rng
+        """
+        return rng.randint(self.min_size, self.max_size)
+
+
+class ParetoSizes:
+
+    def __init__(self, shape: float, scale: int = 1, max_size: float = float('inf')) -> None:
+        """
+        Creates a heavy-tailed flow size distribution: a Pareto distribution with the given shape (tail index) and
+        scale (smallest size), rounded down to whole packets and capped at max_size.
+        """
+        self.shape: float = shape
+        self.scale: int = scale
+        self.max_size: float = max_size
+
+    def draw(self, rng: random.Random) -> int:
+        """
+        Returns a flow size drawn with rng
+        """
+        return int(min(self.scale * rng.paretovariate(self.shape), self.max_size))
+
+
+class TrafficModel(abc.ABC):
+
+    @abc.abstractmethod
+    def pop_arrivals(self, timestep: int) -> list[tuple[str, str, int]]:
+        """
+        Returns the (sender, receiver, number of packets) flows that start at timestep.
+
+        Timesteps are asked for in increasing order, and arrivals before timestep are assumed to have been popped.
+        """
+
+    @abc.abstractmethod
+    def next_arrival(self) -> float:
+        """
+        Returns the next timestep a flow starts at, or infinity if no flow ever will.
+        """
+
+
+class SenderTraffic(TrafficModel):
+
+    def __init__(self, senders: list[str], receivers: list[str], sizes: UniformSizes or ParetoSizes = None, rng: random.Random = None) -> None:
+        """
+        Base class for synthetic traffic where every sender starts flows independently, to receivers chosen uniformly
+        at random, with sizes from the sizes distribution (a single packet by default).
+
+        Each sender waits in a heap keyed by the timestep of its next flow, which subclasses draw in draw_next, so
+        the random draws scale with the number of flows rather than senders times timesteps. rng defaults to the
+        random module.
+        """
+        self.senders: list[str] = senders
+        self.receivers: list[str] = receivers
+        self.sizes = UniformSizes() if sizes is None else sizes
+        self.rng = random if rng is None else rng
+
+        # heap of (timestep, sender index) for the next flow of each sender
+        self.arrivals: list[tuple[int, int]] = []
+
+    def start(self) -> None:
+        """
+        Draws the first flow of every sender. Subclasses call this once their own state is set up.
+        """
+        for index in range(len(self.senders)):
+            self.schedule(index, None)
+
+    @abc.abstractmethod
+    def draw_next(self, index: int, previous: int or None) -> float:
+        """
+        Returns the timestep of the next flow of sender index, given the timestep its previous flow started at (None
+        for its first flow), or infinity if it never sends again.
+        """
+
+    def schedule(self, index: int, previous: int or None) -> None:
+        """
+        Draws the next flow of sender index and pushes it onto the heap.
+        """
+        timestep = self.draw_next(index, previous)
+        if timestep != float('inf'):
+            heapq.heappush(self.arrivals, (timestep, index))
+
+    def pop_arrivals(self, timestep: int) -> list[tuple[str, str, int]]:
+        """
+        Returns the (sender, receiver, number of packets) flows that start at timestep, in sender order.
+        """
+        flows = []
+        while self.arrivals and self.arrivals[0][0] <= timestep:
+            _, index = heapq.heappop(self.arrivals)
+            receiver = self.rng.choice(self.receivers)
+            flows.append((self.senders[index], receiver, self.sizes.draw(self.rng)))
+            self.schedule(index, timestep)
+        return flows
+
+    def next_arrival(self) -> float:
+        """
+        Returns the next timestep a flow starts at, or infinity if no flow ever will.
+        """
+        return self.arrivals[0][0] if self.arrivals else float('inf')
+
+    def draw_geometric(self, probability: float) -> float:
+        """
+        Returns the number of failed trials before the first success, where each trial succeeds with probability.
+        """
+        if probability >= 1:
+            return 0
+        if probability <= 0:
+            return float('inf')
+        # inverse transform sampling, using 1 - random() to keep the log finite
+        return math.floor(math.log(1.0 - self.rng.random()) / math.log1p(-probability))
+
+
+class BernoulliTraffic(SenderTraffic):
+
+    def __init__(self, senders: list[str], receivers: list[str], probability_send: float, sizes: UniformSizes or ParetoSizes = None, rng: random.Random = None) -> None:
+        """
+        Creates traffic where every sender starts a flow at each timestep with probability probability_send.
+
+        Rather than flipping a coin for every sender at every timestep, each sender draws the geometric gap until its
+        next flow, which is the same process.
+        """
+        super().__init__(senders, receivers, sizes, rng)
+        self.probability_send: float = probability_send
+        self.start()
+
+    def draw_next(self, index: int, previous: int or None) -> float:
+        """
+        Returns the timestep of the next flow of sender index, at most one per timestep.
+        """
+        first = 0 if previous is None else previous + 1
+        return first + self.draw_geometric(self.probability_send)
+
+
+class PoissonTraffic(SenderTraffic):
+
+    def __init__(self, senders: list[str], receivers: list[str], rate: float, sizes: UniformSizes or ParetoSizes = None, rng: random.Random = None) -> None:
+        """
+        Creates traffic where every sender starts flows as a Poisson process with rate flows per timestep. A flow
+        starts at the timestep its arrival time falls in, so a sender can start several flows in one timestep.
+        """
+        super().__init__(senders, receivers, sizes, rng)
+        self.rate: float = rate
+        # continuous arrival time of the latest flow of each sender
+        self.clocks: list[float] = [0.0] * len(senders)
+        self.start()
+
+    def draw_next(self, index: int, previous: int or None) -> float:
+        """
+        Returns the timestep of the next flow of sender index, after an exponential gap.
+        """
+        if self.rate <= 0:
+            return float('inf')
+        self.clocks[index] += self.rng.expovariate(self.rate)
+        return math.floor(self.clocks[index])
+
+
+class OnOffTraffic(SenderTraffic):
+
+    def __init__(self, senders: list[str], receivers: list[str], probability_send: float, mean_on: float, mean_off: float, sizes: UniformSizes or ParetoSizes = None, rng: random.Random = None) -> None:
+        """
+        Creates bursty traffic where every sender alternates between on and off periods, whose lengths are geometric
+        with means mean_on and mean_off timesteps. While on, a sender starts a flow at each timestep with probability
+        probability_send, and while off it is silent. Every sender begins at the start of an on period.
+        """
+        super().__init__(senders, receivers, sizes, rng)
+        self.probability_send: float = probability_send
+        self.mean_on: float = mean_on
+        self.mean_off: float = mean_off
+        # the [start, end) timesteps of the current on period of each sender
+        self.periods: list[tuple[int, int]] = [
+            (0, self.draw_duration(mean_on)) for _ in senders]
+        self.start()
+
+    def draw_duration(self, mean: float) -> int:
+        """
+        Returns a period length of at least one timestep, geometric with the given mean
+        """
+        return 1 + self.draw_geometric(1 / max(mean, 1))
+
+    def draw_next(self, index: int, previous: int or None) -> float:
+        """
+        Returns the timestep of the next flow of sender index, skipping over its off periods.
+        """
+        if self.probability_send <= 0:
+            return float('inf')
+        timestep = 0 if previous is None else previous + 1
+        while True:
+            on_start, on_end = self.periods[index]
+            timestep = max(timestep, on_start)
+            if timestep < on_end:
+                timestep += self.draw_geometric(self.probability_send)
+                if timestep < on_end:
+                    return timestep
+            # the rest of this on period is silent, so move on to the next one
+            on_start = on_end + self.draw_duration(self.mean_off)
+            self.periods[index] = (
+                on_start, on_start + self.draw_duration(self.mean_on))
+            timestep = on_start
+
+
+class TraceTraffic(TrafficModel):
+
+    def __init__(self, filename: str) -> None:
+        """
+        Creates traffic that replays a trace file of flows, one 'timestep,src,dst,size' record per line, sorted by
+        timestep. Blank lines and lines starting with # are skipped, and files ending in .gz are decompressed.
+
+        The file is streamed one record at a time, so a trace of any size can drive a simulation without being loaded
+        into memory.
+        """
+        self.filename: str = filename
+        self.records: Iterator[tuple[int, str, str, int]] = self.read_records()
+        # how many records have been taken from the file, which is all a checkpoint needs to reopen it
+        self.position: int = 0
+        self.pending: tuple[int, str, str, int] = self.next_record()
+
+    def __getstate__(self) -> dict:
+        """
+        Returns the state to pickle, e.g. for a checkpoint, which leaves out the open file.
+        """
+        state = dict(self.__dict__)
+        del state['records']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """
+        Restores a pickled trace by reopening its file and skipping the records that had already been taken.
+        """
+        self.__dict__.update(state)
+        self.records = self.read_records()
+        for _ in range(self.position):
+            next(self.records)
+
+    def next_record(self) -> tuple[int, str, str, int] or None:
+        """
+        Takes the next record from the file, or returns None once it is exhausted.
+        """
+        record = next(self.records, None)
+        if record is not None:
+            self.position += 1
+        return record
+
+    def read_records(self) -> Iterator[tuple[int, str, str, int]]:
+        """
+        Yields the records of the trace file in order.
+        """
+        opener = gzip.open if self.filename.endswith('.gz') else open
+        with opener(self.filename, 'rt') as f:
+            previous = float('-inf')
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                timestep, src, dst, size = (
+                    field.strip() for field in line.split(','))
+                timestep = int(timestep)
+                if timestep < previous:
+                    raise ValueError(
+                        f'{self.filename}:{line_number}: trace is not sorted by timestep')
+                previous = timestep
+                yield timestep, src, dst, int(size)
+
+    def pop_arrivals(self, timestep: int) -> list[tuple[str, str, int]]:
+        """
+        Returns the (sender, receiver, number of packets) flows that start at timestep, in file order.
+        """
+        flows = []
+        while self.pending is not None and self.pending[0] <= timestep:
+            flows.append(self.pending[1:])
+            self.pending = self.next_record()
+        return flows
+
+    def next_arrival(self) -> float:
+        """
+        Returns the timestep of the next record, or infinity once the trace is exhausted.
+        """
+        return self.pending[0] if self.pending is not None else float('inf')
+
+
+def build_sizes(config: dict) -> UniformSizes or ParetoSizes:
+    """
+    Returns the flow size distribution described by config, e.g. {'distribution': 'uniform', 'min': 1, 'max': 3} or
+    {'distribution': 'pareto', 'shape': 1.5, 'scale': 1, 'max': 100}.
+    """
+    distribution = config.get('distribution', 'uniform')
+    if distribution == 'uniform':
+        return UniformSizes(config.get('min', 1), config.get('max', 1))
+    if distribution == 'pareto':
+        return ParetoSizes(config['shape'], config.get('scale', 1), config.get('max', float('inf')))
+    raise ValueError(
+        f'unknown flow size distribution {distribution}, expected one of {SIZE_DISTRIBUTIONS}')
+
+
+def build_traffic(config: dict, senders: list[str], receivers: list[str], rng: random.Random = None) -> TrafficModel:
+    """
+    Returns the traffic model described by config, whose 'model' is one of TRAFFIC_MODELS:
+        - 'bernoulli' takes probabilitySend
+        - 'poisson' takes rate
+        - 'onoff' takes probabilitySend, meanOn and meanOff
+        - 'trace' takes file, and ignores senders and receivers
+    Synthetic models take an optional 'sizes' object for build_sizes.
+    """
+    model = config.get('model', 'bernoulli')
+    if model == 'trace':
+        return TraceTraffic(config['file'])
+
+    sizes = build_sizes(config.get('sizes', {}))
+    if model == 'bernoulli':
+        return BernoulliTraffic(senders, receivers, config['probabilitySend'], sizes, rng)
+    if model == 'poisson':
+        return PoissonTraffic(senders, receivers, config['rate'], sizes, rng)
+    if model == 'onoff':
+        return OnOffTraffic(senders, receivers, config['probabilitySend'], config['meanOn'], config['meanOff'], sizes, rng)
+    raise ValueError(
+        f'unknown traffic model {model}, expected one of {TRAFFIC_MODELS}')
@@ -1,77 +1,116 @@
-import json
-import heapq
-import random
-
+import os
+
+from common.checkpoint import get_resumed, read_checkpoint, write_checkpoint
+from common.events import EventCalendar
+from common.metrics import NetworkCounters
+from common.routing import RoutingEngine
+from common.scheduler import RoundRobinScheduler
+from common.streams import RandomStreams
+from common.timeseries import TimeSeriesRecorder
+from common.topology import Topology, load_topology
+from common.traffic import BernoulliTraffic, TrafficModel, UniformSizes
+
+from .coding import CODING_MODES
 from .link import Link
-from .node import Node
+from .node import Node, VALIDATION_LEVELS
 from .packet import Packet
 
 
+# environment variable that picks the node validation level when an arena is not given one
+VALIDATION_ENV_VAR = 'MUNCH_VALIDATION'
+
+
 class Arena:
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, cache_dir: str = None, validation: str = None, seed: int = None) -> None:
         """
         Initialize an arena given a file containing: 
             1. a mapping of node types to their capabilities
             2. nodes of each type (identified by MAC address), and their locations as tuples
             3. rules for which types of nodes are allowed to connect to each other
-        """
-        with open(filename, 'r') as f:
-            data = json.load(f)
 
-        data_rules = data['rules']
-        hierarchies = data['hierarchies']
-        response_wait_time: int = data['responseWaitTime']
-        packet_pool_expiration: int = float('inf')
+        The file may also set packetPoolExpiration, the number of timesteps a node keeps a packet in its pool, and
+        packetPoolCapacity, the most packets a pool can hold before evicting the oldest. Both are unbounded by default.
+        receptionReportResyncInterval sets how often, in timesteps, nodes send a full reception report rather than a
+        delta (16 by default). codingMode is one of CODING_MODES, 'greedy' (the default) or 'exact', and sets how
+        nodes search for packets to code together.
 
-        rules = {h: set() for h in hierarchies}
-        for t1, t2 in data_rules:
-            rules[t1].add(t2)
-            rules[t2].add(t1)
+        If cache_dir is given, the topology is compiled into a binary artifact there (keyed by a hash of the file)
+        the first time it is loaded, and later arenas built from the same file skip parsing and link discovery.
+
+        validation is one of VALIDATION_LEVELS ('off', 'cheap' or 'full'), and sets how much invariant checking nodes
+        do on the hot path. If not given, it is read from the MUNCH_VALIDATION environment variable, and defaults to
+        'full'. Long sweeps should turn it off.
+
+        All randomness comes from the arena's own RandomStreams, seeded from seed (drawn from the random module if not
+        given), and packet ids are allocated per arena, so arenas with the same seed give identical results even when
+        others run in the same process.
+        """
+        if validation is None:
+            validation = os.environ.get(VALIDATION_ENV_VAR, 'full')
+        if validation not in VALIDATION_LEVELS:
+            raise ValueError(
+                f'unknown validation level {validation}, expected one of {VALIDATION_LEVELS}')
+
+        self.topology: Topology = load_topology(filename, cache_dir)
+        response_wait_time: int = self.topology.settings['responseWaitTime']
+        packet_pool_expiration: float = self.topology.settings.get(
+            'packetPoolExpiration', float('inf'))
+        packet_pool_capacity: float = self.topology.settings.get(
+            'packetPoolCapacity', float('inf'))
+        report_resync_interval: float = self.topology.settings.get(
+            'receptionReportResyncInterval', 16)
+        coding_mode: str = self.topology.settings.get('codingMode', 'greedy')
+        if coding_mode not in CODING_MODES:
+            raise ValueError(
+                f'unknown coding mode {coding_mode}, expected one of {CODING_MODES}')
+
+        # independent random streams for traffic, link losses and the MAC layer
+        self.streams: RandomStreams = RandomStreams(seed)
+        # the id the next packet sent in this arena gets
+        self.num_packets: int = 0
+        # network-wide totals, which nodes add to as they go
+        self.counters: NetworkCounters = NetworkCounters()
 
         # mapping of hierarchies to list MAC addresses
-        self.hierarchy_dict: dict[str, list[str]] = {}
+        self.hierarchy_dict: dict[str, list[str]] = {
+            h: [] for h in self.topology.hierarchies}
 
         # mapping of MAC addresses to nodes
         self.node_dict: dict[str, Node] = {}
-
-        for hierarchy in hierarchies:
-            transmit_distance = hierarchies[hierarchy]['strength']
-            list_of_macs = []
-            all_nodes = hierarchies[hierarchy]['nodes'][0]
-
-            for mac_addr, node_obj in all_nodes.items():
-                x = node_obj['x']
-                y = node_obj['y']
-                node = Node(mac_addr, x, y, hierarchy,
-                            transmit_distance, response_wait_time, packet_pool_expiration)
-
-                for link_class in rules[hierarchy]:
-                    # if linked to own class, check against current list of MACs
-                    if link_class == hierarchy:
-                        for other in list_of_macs:
-                            node_other = self.node_dict[other]
-                            node.add_link(node_other)
-                            node_other.add_link(node)
-
-                    # otherwise, check amongst the already finalized hierarchy classes
-                    if link_class not in self.hierarchy_dict:
-                        continue
-                    for other in self.hierarchy_dict[link_class]:
-                        node_other = self.node_dict[other]
-                        node.add_link(node_other)
-                        node_other.add_link(node)
-
-                list_of_macs.append(mac_addr)
-
-                self.node_dict[mac_addr] = node
-
-            self.hierarchy_dict[hierarchy] = list_of_macs
-
-        self.active_node_list: list[str] = list(self.node_dict.keys())
+        # decides the order nodes get to send in, visiting only the ones with packets or reception reports to send
+        self.scheduler: RoundRobinScheduler = RoundRobinScheduler(
+            list(self.topology.macs))
+        # timesteps at which nodes need cleaning up, and the responses they scheduled
+        self.calendar: EventCalendar = EventCalendar()
+
+        for index, mac_addr in enumerate(self.topology.macs):
+            hierarchy = self.topology.hierarchies[self.topology.hierarchy_index[index]]
+            node = Node(mac_addr, self.topology.x[index], self.topology.y[index], hierarchy,
+                        self.topology.get_transmit_distance(index), response_wait_time, packet_pool_expiration, packet_pool_capacity, validation, report_resync_interval, coding_mode, self.scheduler, self.calendar, self.streams, self.counters)
+            self.hierarchy_dict[hierarchy].append(mac_addr)
+            self.node_dict[mac_addr] = node
+
+        # links were already discovered by the topology, in the order nodes would have found them
+        nodes = list(self.node_dict.values())
+        for index, node in enumerate(nodes):
+            for slot in self.topology.get_links(index):
+                node.add_link(nodes[self.topology.indices[slot]],
+                              self.topology.distances[slot])
+
+        # mapping of MAC addresses to the nodes that can not send at the same time as them
+        self.contention: dict[str, set[str]] = {
+            mac_addr: {self.topology.macs[other] for other in self.topology.get_contenders(index)}
+            for index, mac_addr in enumerate(self.topology.macs)}
+
+        self.routing: RoutingEngine = RoutingEngine(self.topology)
         self.timestep: int = 0
-        # memoize the list of best paths
-        self.best_paths: dict[tuple[str, str], list[str]] = {}
+
+        # the traffic and time series recorder of the simulation in progress, kept here so that checkpoints include them
+        self.traffic: TrafficModel or None = None
+        self.recorder: TimeSeriesRecorder or None = None
+        # the timestep this arena was last checkpointed at
+        self.last_checkpoint: int = 0
 
     def can_link(self, node1: str, node2: str) -> bool:
         """
@@ -86,107 +125,96 @@ class Arena:
         """
         Initiates a packet send from a source node, to a given a destination node.
 
-        Uses Dijkstra's to find ideal route from source to destination node.
+        The route is the path of highest success probability, looked up from the routing engine's tree for dst_node.
         """
         if src_node == dst_node:
             return
-        if (src_node, dst_node) in self.best_paths:
-            best_path = self.best_paths[(src_node, dst_node)]
-            packet = Packet(is_two_way, best_path)
-            self.node_dict[src_node].initiate_send(packet, self.timestep)
-            return
-
-        probabilities = {node: 0 for node in self.node_dict.keys()}
-        probabilities[src_node] = -1
-        predecessors = {node: None for node in self.node_dict.keys()}
 
-        priority_queue = [(-1, src_node)]
-
-        while priority_queue:
-            current_prob, current_node = heapq.heappop(priority_queue)
-            if current_prob > probabilities[current_node]:
-                continue
+        # every packet between the same pair of nodes shares one route object
+        route = self.routing.get_route(src_node, dst_node)
+        packet = Packet(is_two_way, route, self.num_packets)
+        self.num_packets += 1
+        self.node_dict[src_node].initiate_send(packet, self.timestep)
 
-            if current_node == dst_node:
-                break
+    def simulate(self, timesteps: int, end_user_hierarchy_class: str, internet_enabled_hierarchy_class: str, min_stream_size: int = 1, max_stream_size: int = 1, probability_send: float = 0.01, event_driven: bool = True, traffic: TrafficModel = None, checkpoint_path: str = None, checkpoint_interval: int = 1000, recorder: TimeSeriesRecorder = None) -> dict[str, float]:
+        """
+        Simulates the arena for a given number of timesteps, with nodes from the end_user_hierarchy_class sending packets, and users from the internet_enabled_hierarchy_class will receive packets.
 
-            node_obj = self.node_dict[current_node]
-            for neighbor in node_obj.get_neighbors():
-                new_prob = current_prob * node_obj.get_probability(neighbor)
-                neighbor_prob = probabilities[neighbor]
+        To simulate data streams, will queue random number of packets between min_stream_size and max_stream_size, and at any timestep the probability that a sender node will enqueue a new message is equal to probability_send. Flows come from a BernoulliTraffic model, which draws the gap until each sender's next flow rather than flipping a coin every timestep.
 
-                if new_prob < neighbor_prob:
-                    probabilities[neighbor] = new_prob
-                    predecessors[neighbor] = current_node
-                    heapq.heappush(priority_queue, (new_prob, neighbor))
+        Any other TrafficModel, such as Poisson, on/off or trace replay traffic, can be passed as traffic instead, in which case it decides who sends when and the sending arguments above are ignored.
 
-        best_path = []
-        current_node = dst_node
-        while current_node is not None:
-            best_path.insert(0, current_node)
-            current_node = predecessors[current_node]
+        If event_driven, timesteps where no flow starts and no node has packets queued, a reception report to send or
+        timed work due are skipped instead of run, jumping straight to the next timestep with work. Results are
+        identical either way.
 
-        self.best_paths[(src_node, dst_node)] = best_path
-        packet = Packet(is_two_way, best_path)
-        self.node_dict[src_node].initiate_send(packet, self.timestep)
+        If checkpoint_path is given, the arena saves a checkpoint there (see save_checkpoint) every checkpoint_interval
+        timesteps. To resume after a crash, load it with load_checkpoint and call simulate with the same arguments.
+        The resumed arena carries on with its checkpointed traffic model, so traffic passed again is only checked to be
+        the same kind of model (and the same trace), and a ValueError is raised if it is not.
 
-    def simulate(self, timesteps: int, end_user_hierarchy_class: str, internet_enabled_hierarchy_class: str, min_stream_size: int = 1, max_stream_size: int = 1, probability_send: float = 0.01) -> dict[str, float]:
-        """
-        Simulates the arena for a given number of timesteps, with nodes from the end_user_hierarchy_class sending packets, and users from the internet_enabled_hierarchy_class will receive packets.
-
-        To simulate data streams, will queue random number of packets between min_stream_size and max_stream_size, and at any timestep the probability that a sender node will enqueue a new message is equal to probability_send.
+        If a recorder is given, the arena records its time series (see get_timeseries_sample) to it every stride
+        timesteps, and closes it once the simulation ends. The recorder is saved with checkpoints, so a resumed
+        simulation carries on recording into the same files, and a recorder passed again must write to the same
+        directory.
         """
+        # a traffic model that is already set belongs to the simulation this arena was checkpointed in
+        self.traffic = get_resumed('traffic', self.traffic, traffic, 'filename')
+        if self.traffic is None:
+            self.traffic = BernoulliTraffic(self.hierarchy_dict[end_user_hierarchy_class], self.hierarchy_dict[internet_enabled_hierarchy_class],
+                                            probability_send, UniformSizes(min_stream_size, max_stream_size), self.streams.traffic)
+        traffic = self.traffic
+        self.recorder = get_resumed('recorder', self.recorder, recorder, 'directory')
         while self.timestep < timesteps:
+            if event_driven:
+                self.skip_to_next_event(min(traffic.next_arrival(), timesteps))
+                if self.timestep >= timesteps:
+                    break
+            self.auto_checkpoint(checkpoint_path, checkpoint_interval)
+            self.auto_record()
             if self.timestep % 1 == 0:
                 print(self.timestep)
-            # queue messages
-            for end_user in self.hierarchy_dict[end_user_hierarchy_class]:
-                # randomly pick a supernode to send to
-                internet_enabled_node = random.choice(
-                    self.hierarchy_dict[internet_enabled_hierarchy_class])
-
-                # with random probability, send a flow
-                if random.random() < probability_send:
-                    num_packets_in_flow = random.randint(
-                        min_stream_size, max_stream_size)
-                    for _ in range(num_packets_in_flow):
-                        self.send_packet(end_user, internet_enabled_node)
+            # queue the flows that start this timestep
+            for end_user, internet_enabled_node, num_packets_in_flow in traffic.pop_arrivals(self.timestep):
+                for _ in range(num_packets_in_flow):
+                    self.send_packet(end_user, internet_enabled_node)
 
             self.run()
 
         # while there are still packets in queues
-        while any(node.packet_in_queues() for node in self.node_dict.values()):
+        while self.packets_in_queues():
+            if event_driven:
+                self.skip_to_next_event()
+            self.auto_checkpoint(checkpoint_path, checkpoint_interval)
+            self.auto_record()
             self.run()
             if self.timestep % 1 == 0:
                 print(self.timestep)
 
         print(self.timestep)
+        self.traffic = None
+        if self.recorder is not None:
+            self.recorder.record(self.timestep, *self.get_timeseries_sample())
+            self.recorder.close()
+            self.recorder = None
 
         # get metrics
         per_node_metrics = {}
         for node_mac, node in self.node_dict.items():
-            sent = node.get_sent()
-            received = node.get_received()
-            coded_packet_history = node.get_coded_packets_history()
-
-            coding_opps = len(
-                [entry for entry in coded_packet_history if len(entry[0]) > 1])
-
-            packet_drops, packet_successes = 0, 0
-            latencies = []
-            for packet_id in sent:
-                if packet_id not in received:
-                    packet_drops += 1
-                else:
-                    packet_successes += 1
-                    latencies.append(received[packet_id] - sent[packet_id])
+            summary = node.get_metrics().get_summary()
+            transmissions, coding_opps, transmitted_packets = node.get_transmission_counts()
 
             per_node_metrics[node_mac] = {
-                'successes': packet_successes,
-                'throughput': packet_successes / timesteps,
-                'drops': packet_drops,
-                'average_latency': sum(latencies)/len(latencies) if len(latencies) > 0 else float('inf'),
+                'successes': summary['successes'],
+                'throughput': summary['successes'] / timesteps,
+                'drops': summary['drops'],
+                'link_drops': node.get_link_drops(),
+                'average_latency': summary['average_latency'],
+                'latency_p50': summary['latency_p50'],
+                'latency_p95': summary['latency_p95'],
+                'latency_p99': summary['latency_p99'],
                 'coding_opps_taken': coding_opps,
+                'packets_per_transmission': transmitted_packets / transmissions if transmissions > 0 else 0,
                 'timesteps': self.timestep
             }
 
@@ -199,52 +227,147 @@ class Arena:
         sending: list[Node] = []
         nexthops = set()
         ht = set()
+        # nodes within range of a sender, which must stay quiet this timestep
+        blocked = set()
 
-        for node in self.active_node_list:
+        for node in self.scheduler.get_ready(self.timestep):
             node_obj = self.node_dict[node]
 
-            if node_obj.get_next_destination() is None:
+            nexthop = node_obj.get_next_destination()
+            if nexthop is None:
                 # checks if all queues are empty
                 node_obj.send_reception_report(self.timestep, override)
+                self.scheduler.discard(node)
                 continue
 
-            # check if medium is free by comparing to nodes in sending
-            for sender in sending:
-                # checks if either one is in range of the other
-                if node_obj.in_range(*sender.get_position()):
-                    break
-                elif sender.in_range(*node_obj.get_position()):
-                    break
+            # the medium is free unless a node that is already sending contends with this one
+            if node in blocked:
+                continue
+            sending.append(node_obj)
+            blocked.update(self.contention[node])
+            if nexthop in nexthops:
+                ht.add(nexthop)
             else:
-                sending.append(node_obj)
-                nexthop = node_obj.get_next_destination()
-                if nexthop in nexthops:
-                    ht.add(nexthop)
-                else:
-                    nexthops.add(nexthop)
+                nexthops.add(nexthop)
 
         for ht_node in ht:
             nexthops.remove(ht_node)
+        self.counters.sends += len(sending)
 
         for sender in sending:
             dest = sender.get_next_destination()
             # if dest in ht:
             #     print('hidden terminal')
+            hidden_terminal = dest in ht
+            self.counters.hidden_terminal_sends += hidden_terminal
             sender.send_from_queues(
-                self.timestep, bool(dest in ht), override)
+                self.timestep, hidden_terminal, override)
 
         for sender in sending:
-            self.active_node_list.remove(sender.get_mac())
-            self.active_node_list.append(sender.get_mac())
+            self.scheduler.move_to_back(sender.get_mac())
 
         # this bit tells nodes whether they should create a response packet
-        for node in self.active_node_list:
+        for node, responses in self.calendar.pop(self.timestep).items():
             node_obj = self.node_dict[node]
             node_obj.cleanup(self.timestep)
-            node_obj.learn_timestep(self.timestep)
+            node_obj.learn_timestep(self.timestep, responses)
+        # cleanup can make a response due straight away if the response wait time is 0
+        for node, responses in self.calendar.pop(self.timestep).items():
+            self.node_dict[node].learn_timestep(self.timestep, responses)
 
         self.timestep += 1
 
+    def save_checkpoint(self, path: str) -> None:
+        """
+        Saves the whole state of this arena to path, including its random streams and the traffic of a simulation in
+        progress. Loading the checkpoint and calling simulate again with the same arguments carries on exactly where
+        the simulation left off, with results identical to a run that was never interrupted.
+        """
+        self.last_checkpoint = self.timestep
+        write_checkpoint(self, Node, path)
+
+    @classmethod
+    def load_checkpoint(cls, path: str) -> 'Arena':
+        """
+        Returns the arena saved to path by save_checkpoint.
+        """
+        arena = read_checkpoint(path, Node)
+        if not isinstance(arena, cls):
+            raise ValueError(f'{path} is a checkpoint of a {type(arena).__module__} arena, not a {cls.__module__} one')
+        return arena
+
+    def auto_checkpoint(self, path: str or None, interval: int) -> None:
+        """
+        Saves a checkpoint to path if one is given and at least interval timesteps have passed since the last one.
+        """
+        if path is not None and self.timestep - self.last_checkpoint >= interval:
+            self.save_checkpoint(path)
+
+    def auto_record(self) -> None:
+        """
+        Records a row of time series if a recorder is set and a row is due.
+        """
+        if self.recorder is not None and self.recorder.is_due(self.timestep):
+            self.recorder.record(self.timestep, *self.get_timeseries_sample())
+
+    def get_timeseries_sample(self) -> tuple[int, tuple[int, ...]]:
+        """
+        Returns the packets queued across the arena, and the running totals of the other series a TimeSeriesRecorder
+        records (see NetworkCounters).
+        """
+        return self.counters.queued, self.counters.get_totals()
+
+    def has_pending_work(self) -> bool:
+        """
+        Returns True iff running the current timestep could do anything, which is when some node is ready to send a
+        packet or reception report, or has timed work due.
+        """
+        next_event = self.calendar.next_timestep()
+        return self.scheduler.has_ready(self.timestep) or (next_event is not None and next_event <= self.timestep)
+
+    def skip_to_next_event(self, until: float = float('inf')) -> None:
+        """
+        Advances the timestep, without running anything, to the next timestep that has pending work, but no further
+        than until.
+        """
+        if self.has_pending_work():
+            return
+        next_events = [t for t in (self.calendar.next_timestep(),
+                                   self.scheduler.next_wakeup()) if t is not None]
+        target = min(next_events + [until])
+        if target != float('inf'):
+            self.timestep = max(self.timestep, target)
+
+    def packets_in_queues(self) -> bool:
+        """
+        Returns True iff any node has packets queued. Only nodes the scheduler considers ready can.
+        """
+        return any(self.node_dict[node].packet_in_queues() for node in self.scheduler.ready)
+
+    def get_probability_matrix(self) -> tuple[list[str], list[list[float]]]:
+        """
+        Returns the MAC addresses of all nodes in this arena, along with a dense matrix where entry [i][j] is the
+        probability that a transmission from the i-th node to the j-th node succeeds (0 if they are not linked).
+        """
+        macs = list(self.node_dict.keys())
+        index = {mac: i for i, mac in enumerate(macs)}
+        matrix = [[0.0] * len(macs) for _ in macs]
+        for i, mac in enumerate(macs):
+            row = matrix[i]
+            for neighbor, link in self.node_dict[mac].links.items():
+                row[index[neighbor]] = link.get_probability()
+        return macs, matrix
+
+    def get_packet_pool_stats(self) -> dict[str, int]:
+        """
+        Returns packet pool memory statistics summed over every node in this arena
+        """
+        totals = {}
+        for node in self.node_dict.values():
+            for stat, value in node.get_packet_pool_stats().items():
+                totals[stat] = totals.get(stat, 0) + value
+        return totals
+
     def get_nodes(self) -> dict[str, Node]:
         """
         Returns a dict mapping MAC addresses to node objects for all nodes in this arena
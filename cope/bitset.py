@@ -0,0 +1,115 @@
+from typing import Iterable, Iterator
+
+# keys are split into chunks of CHUNK_BITS bits, each stored as one Python int
+CHUNK_SHIFT = 9
+CHUNK_BITS = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_BITS - 1
+
+
+class Bitset:
+
+    def __init__(self, keys: Iterable[int] = ()) -> None:
+        """
+        Creates a set of non-negative integers, stored as a bitmap.
+
+        Like a roaring bitmap, the key space is cut into fixed size chunks and only chunks holding at least one key
+        are stored, so dense runs of keys cost a bit each while sparse keys do not pay for the gaps between them.
+        Merging two bitsets works a whole chunk at a time.
+        """
+        self.chunks: dict[int, int] = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: int) -> None:
+        """
+        Adds key to the set
+        """
+        chunk = key >> CHUNK_SHIFT
+        self.chunks[chunk] = self.chunks.get(
+            chunk, 0) | (1 << (key & CHUNK_MASK))
+
+    def discard(self, key: int) -> None:
+        """
+        Removes key from the set if it is there
+        """
+        chunk = key >> CHUNK_SHIFT
+        word = self.chunks.get(chunk)
+        if word is None:
+            return
+        word &= ~(1 << (key & CHUNK_MASK))
+        if word:
+            self.chunks[chunk] = word
+        else:
+            del self.chunks[chunk]
+
+    def copy(self) -> "Bitset":
+        """
+        Returns a copy of this set
+        """
+        other = Bitset()
+        other.chunks = dict(self.chunks)
+        return other
+
+    def __contains__(self, key: int) -> bool:
+        """
+        Returns True iff key is in the set
+        """
+        return (self.chunks.get(key >> CHUNK_SHIFT, 0) >> (key & CHUNK_MASK)) & 1 == 1
+
+    def __ior__(self, other: "Bitset") -> "Bitset":
+        """
+        Adds every key of other to this set
+        """
+        for chunk, word in other.chunks.items():
+            self.chunks[chunk] = self.chunks.get(chunk, 0) | word
+        return self
+
+    def __isub__(self, other: "Bitset") -> "Bitset":
+        """
+        Removes every key of other from this set
+        """
+        for chunk, word in other.chunks.items():
+            if chunk not in self.chunks:
+                continue
+            word = self.chunks[chunk] & ~word
+            if word:
+                self.chunks[chunk] = word
+            else:
+                del self.chunks[chunk]
+        return self
+
+    def __len__(self) -> int:
+        """
+        Returns the number of keys in the set
+        """
+        return sum(word.bit_count() for word in self.chunks.values())
+
+    def __bool__(self) -> bool:
+        """
+        Returns True iff the set is non-empty
+        """
+        return bool(self.chunks)
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        Iterates over the keys in increasing order
+        """
+        for chunk in sorted(self.chunks):
+            word = self.chunks[chunk]
+            base = chunk << CHUNK_SHIFT
+            while word:
+                lowest = word & -word
+                yield base + lowest.bit_length() - 1
+                word ^= lowest
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Returns True iff two sets hold the same keys
+        """
+        return isinstance(other, Bitset) and self.chunks == other.chunks
+
+    def __repr__(self) -> str:
+        """
+        Returns Bitset representation
+        """
+        return f'Bitset({list(self)})'
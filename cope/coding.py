@@ -0,0 +1,113 @@
+from .bitset import Bitset
+
+CODING_MODES = ('greedy', 'exact')
+
+
+class CodingFinder:
+
+    def __init__(self, mode: str = 'greedy', exact_limit: int = 16) -> None:
+        """
+        Creates a finder for coding opportunities amongst the heads of a node's neighbor queues.
+
+        A set of queue heads can be coded together if every nexthop in the set already knows the heads going to the
+        other nexthops. In other words, two neighbors are compatible if each knows the other's head, and a codable set
+        is a clique of compatible neighbors.
+            - 'greedy' walks the neighbors once in queue order, adding each one that is compatible with all of those
+              chosen so far.
+            - 'exact' finds a largest clique, which can code more packets per transmission but is exponential in the
+              worst case, so it falls back to greedy when more than exact_limit neighbors are compatible with the first.
+        """
+        if mode not in CODING_MODES:
+            raise ValueError(
+                f'unknown coding mode {mode}, expected one of {CODING_MODES}')
+        self.mode: str = mode
+        self.exact_limit: int = exact_limit
+
+    def find(self, first: str, heads: dict[str, int], neighbor_state: dict[str, Bitset]) -> list[str]:
+        """
+        Returns the neighbors whose queue heads should be coded together, starting with first.
+
+        heads maps every neighbor with a non-empty queue, in queue order, to the key of its queue head, and
+        neighbor_state maps neighbors to the keys they are known to have.
+        """
+        if self.mode == 'exact':
+            candidates = [neighbor for neighbor in heads if neighbor != first
+                          and self.is_compatible(first, neighbor, heads, neighbor_state)]
+            if len(candidates) <= self.exact_limit:
+                return [first] + self.find_clique(candidates, heads, neighbor_state)
+        return self.find_greedy(first, heads, neighbor_state)
+
+    def find_greedy(self, first: str, heads: dict[str, int], neighbor_state: dict[str, Bitset]) -> list[str]:
+        """
+        Returns first and every neighbor, in queue order, that is compatible with all of the ones chosen before it.
+
+        Only the chosen heads' keys are looked up in each candidate's state, and the candidate's key in each chosen
+        neighbor's state, so a call costs O(neighbors * chosen) lookups however many packets the neighbors know.
+        """
+        chosen = [first]
+        for neighbor, key in heads.items():
+            if neighbor == first:
+                continue
+            state = neighbor_state[neighbor]
+            if all(key in neighbor_state[other] and heads[other] in state for other in chosen):
+                chosen.append(neighbor)
+        return chosen
+
+    def find_clique(self, candidates: list[str], heads: dict[str, int], neighbor_state: dict[str, Bitset]) -> list[str]:
+        """
+        Returns a largest set of mutually compatible candidates, in queue order.
+
+        This is Bron-Kerbosch with pivoting over adjacency bitmasks. Amongst sets of the largest size, the one found
+        first is kept, which favours neighbors earlier in queue order.
+        """
+        adjacency = [0] * len(candidates)
+        for i in range(len(candidates)):
+            for j in range(i + 1, len(candidates)):
+                if self.is_compatible(candidates[i], candidates[j], heads, neighbor_state):
+                    adjacency[i] |= 1 << j
+                    adjacency[j] |= 1 << i
+
+        best = 0
+        best_size = 0
+        stack = [(0, (1 << len(candidates)) - 1, 0)]
+        while stack:
+            clique, possible, excluded = stack.pop()
+            if not possible:
+                if not excluded and clique.bit_count() > best_size:
+                    best, best_size = clique, clique.bit_count()
+                continue
+            if clique.bit_count() + possible.bit_count() <= best_size:
+                continue
+
+            # branching only on non-neighbors of the pivot skips cliques that could not be the largest
+            pivot, pivot_degree = 0, -1
+            remaining = possible | excluded
+            while remaining:
+                low = remaining & -remaining
+                v = low.bit_length() - 1
+                degree = (adjacency[v] & possible).bit_count()
+                if degree > pivot_degree:
+                    pivot, pivot_degree = v, degree
+                remaining ^= low
+
+            branches = []
+            remaining = possible & ~adjacency[pivot]
+            while remaining:
+                low = remaining & -remaining
+                v = low.bit_length() - 1
+                branches.append(
+                    (clique | low, possible & adjacency[v], excluded & adjacency[v]))
+                possible &= ~low
+                excluded |= low
+                remaining ^= low
+            # push in reverse so the earliest candidates are explored first
+            stack.extend(reversed(branches))
+
+        return [candidate for i, candidate in enumerate(candidates) if best >> i & 1]
+
+    @staticmethod
+    def is_compatible(a: str, b: str, heads: dict[str, int], neighbor_state: dict[str, Bitset]) -> bool:
+        """
+        Returns True iff neighbors a and b each know the other's queue head.
+        """
+        return heads[b] in neighbor_state[a] and heads[a] in neighbor_state[b]
@@ -5,12 +5,28 @@ from .packet import COPEPacket, ReceptionReport
 
 class Link:
 
-    def __init__(self, node1: Any, node2: Any) -> None:
+    def __init__(self, node1: Any, node2: Any, distance: float = None, rng: random.Random = None) -> None:
         """
         Creates a link object between node1 and node2. 
+
+        The distance between the nodes and the resulting transmission probability are computed once here, since
+        nodes never move. If distance is supplied it is trusted rather than recomputed.
+
+        Transmissions are lost according to draws from rng, which defaults to the random module.
         """
         self.node1 = node1
         self.node2 = node2
+        self.rng = random if rng is None else rng
+
+        if distance is None:
+            n1_x, n1_y = node1.get_position()
+            n2_x, n2_y = node2.get_position()
+            distance = ((n1_x - n2_x) ** 2 + (n1_y - n2_y) ** 2) ** 0.5
+        transmit_range = min(node1.get_transmit_distance(),
+                             node2.get_transmit_distance())
+
+        self.distance: float = distance
+        self.probability: float = max(1 - 0.8 * distance / transmit_range, 0)
 
     def transmit(self, packet: COPEPacket, source: str, timestep: int, override: bool) -> bool:
         """
@@ -18,7 +34,7 @@ class Link:
 
         Determined based on distance between nodes and strengths of the nodes. 
         """
-        success = random.random() < self.get_probability()
+        success = self.rng.random() < self.get_probability()
         if override:
             success = True
         if not success:
@@ -39,7 +55,7 @@ class Link:
 
         Determined based on distance between nodes and strengths of the nodes. 
         """
-        success = random.random() < self.get_probability()
+        success = self.rng.random() < self.get_probability()
         if override:
             success = True
         if not success:
@@ -57,10 +73,10 @@ class Link:
         """
         Return the probability of successful transmission along this node using the formula from https://ieeexplore.ieee.org/stamp/stamp.jsp?tp=&arnumber=7954581, with randomness in the formula removed for ease of testing. 
         """
-        transmit_range = min(self.node1.get_transmit_distance(),
-                             self.node2.get_transmit_distance())
-        n1_x, n1_y = self.node1.get_position()
-        n2_x, n2_y = self.node2.get_position()
-        actual = ((n1_x - n2_x) ** 2 + (n1_y - n2_y) ** 2) ** 0.5
+        return self.probability
 
-        return max(1 - 0.8 * actual / transmit_range, 0)
+    def get_distance(self) -> float:
+        """
+        Return the distance between the two ends of this link.
+        """
+        return self.distance
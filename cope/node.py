@@ -1,47 +1,115 @@
+import heapq
+import math
+import random
+from collections import deque
+
+from common.events import EventCalendar
+from common.metrics import NetworkCounters, PacketMetrics
+from common.scheduler import RoundRobinScheduler
+from common.streams import RandomStreams
+
 from .packet import Packet, COPEPacket, ReceptionReport
 from .link import Link
+from .bitset import Bitset
+from .coding import CodingFinder
+from .packet_pool import PacketPool
+
+# how much of its representation a node checks on every operation, from nothing at all to walking every queue
+VALIDATION_LEVELS = ('off', 'cheap', 'full')
 
 
 class Node:
 
-    def __init__(self, mac_address: str, x: float, y: float, hierarchy_class: str, transmit_distance: float, response_wait_time: int, packet_pool_expiration: float) -> None:
+    def __init__(self, mac_address: str, x: float, y: float, hierarchy_class: str, transmit_distance: float, response_wait_time: int, packet_pool_expiration: float, packet_pool_capacity: float = float('inf'), validation: str = 'full', report_resync_interval: float = 16, coding_mode: str = 'greedy', scheduler: RoundRobinScheduler = None, calendar: EventCalendar = None, streams: RandomStreams = None, counters: NetworkCounters = None) -> None:
         """
         Creates a node object
+
+        Packets leave the node's pool once they have been in it for packet_pool_expiration timesteps, or when it
+        grows past packet_pool_capacity packets, oldest first.
+
+        Reception reports only carry changes to the pool, except that a full report is sent at the first report on or
+        after each multiple of report_resync_interval timesteps, so neighbors that missed a delta catch up. Resyncs
+        fall on the same timesteps at every node, so idle nodes wake for them together.
+
+        validation is one of VALIDATION_LEVELS, and sets how thoroughly check_rep checks this node.
+
+        coding_mode is one of CODING_MODES, and sets how the node searches for packets to code together.
+
+        If a scheduler is given, the node marks itself ready in it whenever it has packets queued or a reception
+        report worth sending. The node records in calendar every timestep that it needs cleanup or learn_timestep to
+        be called at: when its pool changed, when pooled packets expire, or when a response is due, in which case the
+        response itself is scheduled too. The calendar is shared with the arena, which fires the due entries. Without
+        one, the node keeps a calendar of its own.
+
+        Whether neighbors hear a broadcast is drawn from the links stream of streams, or from the random module
+        without one. Queued packets, completed packets, link drops and coded packets are also tracked in the
+        network-wide counters, if given.
         """
+        if validation not in VALIDATION_LEVELS:
+            raise ValueError(
+                f'unknown validation level {validation}, expected one of {VALIDATION_LEVELS}')
+        self.validation: str = validation
         self.mac_address = mac_address
         self.x, self.y = x, y
         self.hierarchy_class: str = hierarchy_class
         self.transmit_distance: float = transmit_distance
         self.response_wait_time: int = response_wait_time
 
+        self.rng = random if streams is None else streams.links
         self.links: dict[str, Link] = {}
-        self.queues: dict[str, list[tuple[Packet, int]]] = {}
-        self.waiting_for_response: dict[int, Packet] = {}
+        # the neighbors at the far end of each link and their delivery probabilities, in link order, built on the
+        # first broadcast after links change
+        self.broadcast_targets: tuple[list['Node'], list[float]] or None = None
+        self.queues: dict[str, deque[tuple[Packet, int]]] = {}
+        # position of each neighbor in self.queues, used to break ties between queue heads of the same age
+        self.queue_order: dict[str, int] = {}
+        # heap of (timestep, queue_order, neighbor) for queue heads. Entries are removed lazily, so an entry is only
+        # current if that neighbor's queue is non-empty and its head has that timestep
+        self.queue_heads: list[tuple[int, int, str]] = []
+        self.queued_packets: int = 0
         self.waiting_for_cleanup: dict[int, Packet] = {}
-        self.packet_pool: dict[tuple[str, bool], int] = {}
-        self.neighbor_state: dict[str, set[tuple[int, bool]]] = {}
+        self.packet_pool: PacketPool = PacketPool(
+            packet_pool_expiration, packet_pool_capacity)
+        self.neighbor_state: dict[str, Bitset] = {}
         self.packet_pool_expiration: int = packet_pool_expiration
-
-        self.sent: dict[int, int] = {}
-        self.received: dict[int, int] = {}
+        self.report_resync_interval: float = report_resync_interval
+        self.coding: CodingFinder = CodingFinder(coding_mode)
+        self.scheduler: RoundRobinScheduler = scheduler
+        self.calendar: EventCalendar = EventCalendar() if calendar is None else calendar
+        # the timestep from which the next report is a full one
+        self.next_full_report: float = 0
+
+        self.counters: NetworkCounters = NetworkCounters() if counters is None else counters
+        self.metrics: PacketMetrics = PacketMetrics(self.counters)
         self.received_packets: int = 0
-        self.coded_packets_history: list[tuple[list[int], int]] = []
+        # how many COPE packets this node has sent, how many of them were coded, and how many packets they carried
+        self.transmissions: int = 0
+        self.coded_transmissions: int = 0
+        self.transmitted_packets: int = 0
+        # how many packets this node sent that their next hop did not hear
+        self.link_drops: int = 0
 
         self.resurrected = {}
         self.reversing = set()
 
-    def add_link(self, other: "Node") -> None:
+    def add_link(self, other: "Node", actual: float = None) -> None:
         """
         Adds a link from self to other and creates a queue for that neighbor in self.
+
+        If actual is given, it is taken as the distance between the two nodes instead of being recomputed.
         """
         distance = min(self.transmit_distance, other.get_transmit_distance())
-        other_x, other_y = other.get_position()
-        actual = ((self.x - other_x) ** 2 + (self.y - other_y) ** 2) ** 0.5
+        if actual is None:
+            other_x, other_y = other.get_position()
+            actual = ((self.x - other_x) ** 2 +
+                      (self.y - other_y) ** 2) ** 0.5
         if actual <= distance:
-            link = Link(self, other)
+            link = Link(self, other, actual, self.rng)
             self.links[other.get_mac()] = link
-            self.queues[other.get_mac()] = []
-            self.neighbor_state[other.get_mac()] = set()
+            self.broadcast_targets = None
+            self.queues[other.get_mac()] = deque()
+            self.queue_order[other.get_mac()] = len(self.queue_order)
+            self.neighbor_state[other.get_mac()] = Bitset()
         self.check_rep()
         return
 
@@ -49,10 +117,12 @@ class Node:
         """
         Initiates the send of packet.
         """
-        self.sent[packet.get_id()] = timestep
-        self.queues[packet.get_path()[1]].append((packet, timestep))
-        self.packet_pool[(packet.get_id(), True)] = timestep
-        self.check_rep()
+        packet.mark_sent(timestep)
+        self.metrics.record_sent(packet.get_id(), timestep)
+        self.push_to_queue(packet.get_nexthop(
+            self.mac_address), (packet, timestep))
+        self.add_to_pool(packet.get_key(), timestep, timestep)
+        self.check_rep(packet)
         return
 
     def enqueue_packet(self, packet: Packet, timestep: int) -> None:
@@ -63,27 +133,26 @@ class Node:
             If yes, we are done. If no, enqueue a response packet and send back to original src.
         """
         assert not (packet.get_is_request()
-                    and packet.get_path()[0] == self.get_mac())
+                    and packet.get_src() == self.get_mac())
         # we are the final destination of a response
-        if packet.get_id() in self.sent or (not packet.get_is_request() and packet.get_path()[-1] == self.get_mac()):
-            self.received[packet.get_id()] = timestep
+        if self.metrics.is_in_flight(packet.get_id()) or (not packet.get_is_request() and packet.get_dst() == self.get_mac()):
+            self.metrics.record_received(packet.get_id(), timestep)
             self.received_packets += 1
         # we are the final destination of a request
-        elif packet.get_is_request() and packet.get_path()[-1] == self.get_mac():
+        elif packet.get_is_request() and packet.get_dst() == self.get_mac():
             self.reversing.add(packet.get_id())
             self.waiting_for_cleanup[timestep] = packet.get_reverse()
         # we are engaging in promiscuous listening
-        elif self.get_mac() not in packet.get_path():
+        elif not packet.is_on_path(self.get_mac()):
             pass
         # we are a node on the path
         else:
-            self.check_rep()
-            path = packet.get_path()
-            nexthop = path[path.index(self.mac_address) + 1]
-            self.queues[nexthop].append((packet, timestep))
-            self.check_rep()
+            self.check_rep(packet)
+            nexthop = packet.get_nexthop(self.mac_address)
+            self.push_to_queue(nexthop, (packet, timestep))
+            self.check_rep(packet)
         # should always be putting a packet that we enqueue into our pool
-        self.packet_pool[(packet.get_id(), packet.get_is_request())] = timestep
+        self.add_to_pool(packet.get_key(), timestep, timestep)
         self.check_rep()
         return
 
@@ -97,11 +166,12 @@ class Node:
         packets = cope_packet.get_packets()
         new_packet = None
         for packet in packets:
-            if (packet.get_id(), packet.get_is_request()) in self.packet_pool:
+            if packet.get_key() in self.packet_pool:
                 continue
-            elif packet.get_id() in self.sent and packet.get_is_request():
-                self.packet_pool[(packet.get_id(), True)
-                                 ] = self.sent[packet.get_id()]
+            # our own request, overheard after it left the pool, goes back in as of when it was sent
+            elif packet.get_is_request() and packet.get_src() == self.mac_address:
+                self.add_to_pool(
+                    packet.get_key(), packet.get_sent_at(), timestep)
                 continue
 
             if new_packet is None:
@@ -123,8 +193,7 @@ class Node:
             # print('old fixed point')
             raise ValueError(new_packet.get_id())
 
-        self.packet_pool[(new_packet.get_id(),
-                          new_packet.get_is_request())] = timestep
+        self.add_to_pool(new_packet.get_key(), timestep, timestep)
         self.enqueue_packet(new_packet, timestep)
         return
 
@@ -132,72 +201,116 @@ class Node:
         """
         Cleans up hidden terminal collisions for nodes in promiscuous mode
         """
-        if list(self.packet_pool.values()).count(timestep) > 1:
-            self.packet_pool = {p: t for p,
-                                t in self.packet_pool.items() if t != timestep}
+        if self.packet_pool.count_at(timestep) > 1:
+            self.packet_pool.discard_timestep(timestep)
             self.waiting_for_cleanup = {}
         else:
             for t in self.waiting_for_cleanup:
-                self.waiting_for_response[t +
-                                          self.response_wait_time] = self.waiting_for_cleanup[t]
+                self.calendar.schedule(t + self.response_wait_time,
+                                       self.mac_address, self.waiting_for_cleanup[t])
                 self.waiting_for_cleanup = {}
 
-        self.packet_pool = {p: t for p, t in self.packet_pool.items(
-        ) if timestep - t < self.packet_pool_expiration}
+        self.packet_pool.expire(timestep)
+        if self.packet_pool.has_delta():
+            self.wake()
         return
 
+    def add_to_pool(self, key: int, pooled_at: int, timestep: int) -> None:
+        """
+        Pools key as of timestep pooled_at, at the current timestep.
+
+        The pool has changed, so the node needs cleaning up this timestep, has a delta to report, and may have a
+        packet to expire later.
+        """
+        self.packet_pool.add(key, pooled_at)
+        self.wake()
+        self.calendar.schedule(timestep, self.mac_address)
+        if self.packet_pool_expiration != float('inf'):
+            self.calendar.schedule(
+                max(timestep, math.ceil(pooled_at + self.packet_pool_expiration)), self.mac_address)
+
     def receive_reception_report(self, report: ReceptionReport) -> None:
         """
         Updates self's state based on the reception report
         """
         node = report.get_node()
-        packets = report.get_packets()
-        self.neighbor_state[node] = set(packets)
+        if report.is_delta():
+            state = self.neighbor_state[node]
+            state -= report.get_removed_packets()
+            state |= report.get_packets()
+        else:
+            self.neighbor_state[node] = report.get_packets().copy()
         return
 
-    def learn_timestep(self, timestep: int) -> None:
+    def learn_timestep(self, timestep: int, responses: list[Packet] = ()) -> None:
         """
-        Tells this node the timestep that the arena is currently on. Updates the queue if it should 
+        Tells this node the timestep that the arena is currently on, along with the responses it scheduled that are
+        now due. Each response is enqueued in the order it was scheduled.
         """
-        if timestep not in self.waiting_for_response:
-            return
-
-        response_packet = self.waiting_for_response.pop(timestep)
-        if response_packet.get_id() in self.resurrected:
-            # print(timestep)
-            # print(self.resurrected)
-            raise ValueError
-        assert not response_packet.get_is_request()
-        self.enqueue_packet(response_packet, timestep)
-        self.check_rep()
-        self.resurrected[response_packet.get_id()] = False
+        for response_packet in responses:
+            if response_packet.get_id() in self.resurrected:
+                # print(timestep)
+                # print(self.resurrected)
+                raise ValueError
+            assert not response_packet.get_is_request()
+            self.enqueue_packet(response_packet, timestep)
+            self.check_rep()
+            self.resurrected[response_packet.get_id()] = False
         return
 
     def get_next_destination(self) -> str:
         """
         Returns the MAC address of the nexthop of the packets that will be sent next.
+
+        This is the neighbor whose queue head has waited longest, with ties going to the neighbor linked first. It is
+        read off the heap of queue heads, discarding entries for heads that have since been sent.
         """
-        smallest = float('inf')
         nexthop = None
-        for neighbor, queue in self.queues.items():
-            if not queue:
-                continue
-            elif queue[0][1] < smallest:
+        while self.queue_heads:
+            timestep, _, neighbor = self.queue_heads[0]
+            queue = self.queues[neighbor]
+            if queue and queue[0][1] == timestep:
                 nexthop = neighbor
-                smallest = queue[0][1]
+                break
+            heapq.heappop(self.queue_heads)
 
-        self.check_rep()
+        self.check_rep(self.queues[nexthop][0][0] if nexthop else None)
         return nexthop
 
+    def push_to_queue(self, neighbor: str, entry: tuple[Packet, int]) -> None:
+        """
+        Appends a (packet, timestep) entry to the queue for neighbor, keeping the index of queue heads up to date.
+        """
+        queue = self.queues[neighbor]
+        queue.append(entry)
+        self.queued_packets += 1
+        self.counters.queued += 1
+        self.wake()
+        if len(queue) == 1:
+            heapq.heappush(self.queue_heads,
+                           (entry[1], self.queue_order[neighbor], neighbor))
+
+    def pop_from_queue(self, neighbor: str) -> tuple[Packet, int]:
+        """
+        Removes and returns the (packet, timestep) entry at the head of the queue for neighbor.
+        """
+        queue = self.queues[neighbor]
+        entry = queue.popleft()
+        self.queued_packets -= 1
+        self.counters.queued -= 1
+        if queue:
+            heapq.heappush(self.queue_heads,
+                           (queue[0][1], self.queue_order[neighbor], neighbor))
+        return entry
+
     def send_from_queues(self, timestep: int, hidden_terminal: bool, override: bool) -> None:
         """
-        Look for an encoding opportunity amongst the heads of our neighbor queues.
+        Look for an encoding opportunity amongst the heads of our neighbor queues, using the node's CodingFinder.
 
         Dequeues the next packet(s), creates a COPEPacket object, and sends the packet to its next hops. 
         """
         single = self.get_next_destination()
-        nexthops = [single]
-        packet = self.queues[single].pop(0)[0]
+        packet = self.pop_from_queue(single)[0]
         if packet.get_id() in self.resurrected:
             assert not self.resurrected[packet.get_id()]
             self.resurrected[packet.get_id()] = True
@@ -205,36 +318,37 @@ class Node:
         self.check_rep()
         if hidden_terminal:
             return
-        for neighbor, q in self.queues.items():  # adds all packets to the copepacket
-            if neighbor != nexthops[0]:
-                if not (q and all((p.get_id(), p.get_is_request()) in self.neighbor_state[neighbor] for p in packets)):
-                    # checks to see that all previous packets are in neighbor's packet pool
-                    continue
-
-                p = q[0][0]
-                if not all((p.get_id(), p.get_is_request()) in self.neighbor_state[node] for node in nexthops):
-                    # checks to see if the node single knows p
-                    continue
-
-                if packet.get_id() in self.resurrected:
-                    assert not self.resurrected[packet.get_id()]
-                    self.resurrected[packet.get_id()] = True
-
-                packets.append(q.pop(0)[0])
-                nexthops.append(neighbor)
+        heads = {single: packet.get_key()}
+        for neighbor, q in self.queues.items():
+            if q and neighbor != single:
+                heads[neighbor] = q[0][0].get_key()
+        nexthops = self.coding.find(single, heads, self.neighbor_state)
+
+        for neighbor in nexthops[1:]:  # adds all coded packets to the copepacket
+            p = self.pop_from_queue(neighbor)[0]
+            if p.get_id() in self.resurrected:
+                assert not self.resurrected[p.get_id()]
+                self.resurrected[p.get_id()] = True
+            packets.append(p)
 
         for neighbor in nexthops:  # this ensures fairness, so we are not just encoding the same people
             self.neighbor_state[neighbor] = self.neighbor_state.pop(neighbor)
 
-        cope_packet = COPEPacket(packets, ReceptionReport(
-            set(self.packet_pool), self.mac_address))
+        cope_packet = COPEPacket(
+            packets, self.make_reception_report(timestep, True))
 
-        self.coded_packets_history.append(
-            ([packet.get_id() for packet in packets], timestep))
+        self.transmissions += 1
+        self.coded_transmissions += len(packets) > 1
+        self.counters.coded_packets += len(packets) > 1
+        self.transmitted_packets += len(packets)
 
-        for nexthop in self.links:
-            self.links[nexthop].transmit(
-                cope_packet, self.mac_address, timestep, override)
+        heard = set()
+        for neighbor in self.broadcast(override):
+            heard.add(neighbor.get_mac())
+            neighbor.receive_cope_packet(cope_packet, timestep)
+        link_drops = sum(nexthop not in heard for nexthop in nexthops)
+        self.link_drops += link_drops
+        self.counters.link_drops += link_drops
 
         self.check_rep()
         return
@@ -243,23 +357,76 @@ class Node:
         """
         Node sends a reception report to all its neighbors
         """
-        report = ReceptionReport(
-            set(p for p in self.packet_pool), self.mac_address)
-        for _, link in self.links.items():
-            link.transmit_reception_report(
-                report, self.mac_address, timestep, override)
+        report = self.make_reception_report(timestep, False)
+        if report is None:
+            return
+        for neighbor in self.broadcast(override):
+            neighbor.receive_reception_report(report)
         return
 
+    def broadcast(self, override: bool) -> list['Node']:
+        """
+        Draws whether each neighbor hears one transmission from this node, and returns the neighbors that do, in link
+        order. If override, every neighbor hears it.
+
+        All outcomes are drawn in a single pass against the cached probabilities of this node's links, one draw per
+        link as Link.transmit would make, so the callers only touch the neighbors that receive something.
+        """
+        if self.broadcast_targets is None:
+            links = list(self.links.values())
+            self.broadcast_targets = ([link.node2 if link.node1 is self else link.node1 for link in links],
+                                      [link.get_probability() for link in links])
+        neighbors, probabilities = self.broadcast_targets
+        draw = self.rng.random
+        # the draw comes first so that override does not change the random stream
+        return [neighbor for neighbor, probability in zip(neighbors, probabilities) if draw() < probability or override]
+
+    def make_reception_report(self, timestep: int, always: bool) -> ReceptionReport or None:
+        """
+        Returns the reception report self should broadcast at timestep.
+
+        This is usually a delta of the pool since the last report, but is a full report if a resync is due. If
+        nothing has changed and always is False, there is nothing worth sending and None is returned.
+        """
+        if timestep >= self.next_full_report:
+            self.next_full_report = (timestep // self.report_resync_interval + 1) * self.report_resync_interval
+            if self.scheduler is not None:
+                self.scheduler.wake_at(self.mac_address, self.next_full_report)
+            self.packet_pool.take_delta()
+            return ReceptionReport(self.packet_pool.get_members().copy(), self.mac_address)
+
+        added, removed = self.packet_pool.take_delta()
+        if not (always or added or removed):
+            return None
+        return ReceptionReport(added, self.mac_address, removed)
+
+    def wake(self) -> None:
+        """
+        Tells the scheduler, if there is one, that this node has something to send.
+        """
+        if self.scheduler is not None:
+            self.scheduler.mark_ready(self.mac_address)
+
     def packet_in_queues(self) -> bool:
         """
         Returns True iff there are packets in any of the nodes' queues
         """
-        return self.get_next_destination() is not None
+        return self.queued_packets > 0
 
-    def check_rep(self) -> None:
+    def check_rep(self, packet: Packet = None) -> None:
         """
         Asserts this representation is correct
+
+        At the 'full' validation level every queued packet is checked. At 'cheap' only packet is, if given, which
+        callers should only pass when it is queued. At 'off' nothing is checked.
         """
+        if self.validation == 'off':
+            return
+        if self.validation == 'cheap':
+            if packet is not None and packet.get_id() in self.resurrected:
+                assert not self.resurrected[packet.get_id()]
+            return
+
         for _, q in self.queues.items():
             for packet, _ in q:
                 if packet.get_id() in self.resurrected:
@@ -288,7 +455,7 @@ class Node:
         """
         Returns the state of all queues of self
         """
-        return {k: v[:] for k, v in self.queues.items()}
+        return {k: list(v) for k, v in self.queues.items()}
 
     def get_packets_received(self) -> int:
         """
@@ -329,29 +496,36 @@ class Node:
 
         return self.links[neighbor].get_probability()
 
-    def get_packet_pool(self) -> set[int]:
+    def get_packet_pool(self) -> PacketPool:
         """
         Returns the packet pool of self
         """
         return self.packet_pool
 
-    def get_sent(self) -> dict[str, str]:
+    def get_packet_pool_stats(self) -> dict[str, int]:
+        """
+        Returns memory statistics for the packet pool of self
+        """
+        return self.packet_pool.get_stats()
+
+    def get_metrics(self) -> PacketMetrics:
         """
-        Return a dictionary of packets sent by this node and their timesteps
+        Returns the metrics of the packets this node has sent
         """
-        return {k: v for k, v in self.sent.items()}
+        return self.metrics
 
-    def get_received(self) -> dict[str, str]:
+    def get_link_drops(self) -> int:
         """
-        Return a dictionary of packets received by this node and their timesteps
+        Returns the number of packets this node sent that were lost on the link to their next hop
         """
-        return {k: v for k, v in self.received.items()}
+        return self.link_drops
 
-    def get_coded_packets_history(self) -> list[tuple[list[int], int]]:
+    def get_transmission_counts(self) -> tuple[int, int, int]:
         """
-        Return the packet coding history for this node. 
+        Returns how many COPE packets this node has sent, how many of those were coded, and how many packets they
+        carried in total.
         """
-        return [(entry[0][:], entry[1]) for entry in self.coded_packets_history]
+        return self.transmissions, self.coded_transmissions, self.transmitted_packets
 
     def __str__(self) -> str:
         """
@@ -1,14 +1,23 @@
 from typing import Any
 
+from common.routing import Route
+
+from .bitset import Bitset
+
 
 class Packet:
     num_packets = 0
 
-    def __init__(self, is_request: bool, path_to_dst: list[str], packet_id: int = None) -> None:
+    def __init__(self, is_request: bool, path_to_dst: list[str] or Route, packet_id: int = None) -> None:
         """
         Creates a packet given a path to the destination MAC address and a packet size in bytes.
 
         Each packet also has packet_id, and notes whether it is a request for the destination or a response from the destination.
+
+        If no packet id is supplied, the next one is taken from a counter shared by the whole process. Arenas allocate
+        their own ids instead, so that they do not depend on each other.
+
+        The path can be given as a shared Route, in which case the packet just references it rather than copying it.
         """
         if packet_id is None:
             self.packet_id = Packet.num_packets
@@ -17,13 +26,46 @@ class Packet:
             self.packet_id = packet_id
 
         self.is_request = is_request
-        self.path_to_dst: list[str] = path_to_dst
+        self.route: Route = path_to_dst if isinstance(
+            path_to_dst, Route) else Route(tuple(path_to_dst))
+        # the timestep the source sent this packet at, once it has
+        self.sent_at: int or None = None
 
     def get_path(self) -> list[str]:
         """
         Gets the packet's path to destination.
         """
-        return self.path_to_dst[:]
+        return list(self.route.hops)
+
+    def get_route(self) -> Route:
+        """
+        Gets the shared route this packet travels along.
+        """
+        return self.route
+
+    def get_src(self) -> str:
+        """
+        Gets the MAC address of the node this packet starts at.
+        """
+        return self.route.get_src()
+
+    def get_dst(self) -> str:
+        """
+        Gets the MAC address of this packet's destination.
+        """
+        return self.route.get_dst()
+
+    def get_nexthop(self, mac: str) -> str:
+        """
+        Gets the MAC address of the node after mac on this packet's path.
+        """
+        return self.route.get_nexthop(mac)
+
+    def is_on_path(self, mac: str) -> bool:
+        """
+        Returns True iff mac is one of the nodes on this packet's path.
+        """
+        return mac in self.route
 
     def get_is_request(self) -> bool:
         """
@@ -37,12 +79,30 @@ class Packet:
         """
         return self.packet_id
 
+    def get_key(self) -> int:
+        """
+        Returns the key this packet is known by in packet pools and reception reports, 2 * packet_id + is_request.
+        """
+        return 2 * self.packet_id + self.is_request
+
+    def mark_sent(self, timestep: int) -> None:
+        """
+        Records that the source sent this packet at timestep.
+        """
+        self.sent_at = timestep
+
+    def get_sent_at(self) -> int or None:
+        """
+        Gets the timestep the source sent this packet at, or None if it has not been sent.
+        """
+        return self.sent_at
+
     def get_reverse(self) -> "Packet":
         """
         Returns a packet that is response of this packet.
         """
         assert self.is_request, 'can not get the reverse of a response packet'
-        return Packet(False, self.path_to_dst[::-1], self.packet_id)
+        return Packet(False, self.route.get_reverse(), self.packet_id)
 
     def __eq__(self, other: Any) -> bool:
         """
@@ -54,7 +114,7 @@ class Packet:
             return False
         if not self.is_request == other.is_request:
             return False
-        if not self.path_to_dst == other.path_to_dst:
+        if not self.route == other.route:
             return False
         return True
 
@@ -62,15 +122,19 @@ class Packet:
         """
         your mom 
         """
-        return f'({self.packet_id}, {self.is_request}, {self.path_to_dst})'
+        return f'({self.packet_id}, {self.is_request}, {list(self.route.hops)})'
 
 class ReceptionReport:
 
-    def __init__(self, stored_packets: set[tuple[int, bool]], node: str):
+    def __init__(self, stored_packets: Bitset, node: str, removed_packets: Bitset = None):
         """
-        Create a reception report for a given node, given a list of packet IDs it has stored.
+        Create a reception report for a given node, given the keys (see Packet.get_key) of the packets it has stored.
+
+        If removed_packets is given, this is a delta report: stored_packets are only the packets node has stored since
+        its last report, and removed_packets the ones it has let go of. Otherwise it is a full report of node's pool.
         """
         self.stored_packets = stored_packets
+        self.removed_packets = removed_packets
         self.node = node
 
     def get_node(self) -> str:
@@ -79,12 +143,24 @@ class ReceptionReport:
         """
         return self.node
 
-    def get_packets(self) -> set[tuple[int, bool]]:
+    def get_packets(self) -> Bitset:
         """
         Gets the packets that are self.get_node() is confirmed to have
         """
         return self.stored_packets
 
+    def get_removed_packets(self) -> Bitset:
+        """
+        Gets the packets that self.get_node() no longer has, which is empty for a full report
+        """
+        return self.removed_packets if self.removed_packets is not None else Bitset()
+
+    def is_delta(self) -> bool:
+        """
+        Returns True iff this report only carries changes since the node's last report
+        """
+        return self.removed_packets is not None
+
 
 class COPEPacket:
 
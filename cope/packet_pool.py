@@ -0,0 +1,195 @@
+import heapq
+
+from .bitset import Bitset
+
+
+class PacketPool:
+
+    def __init__(self, expiration: float = float('inf'), capacity: float = float('inf')) -> None:
+        """
+        Creates an empty packet pool, holding the keys (see Packet.get_key) of the packets a node knows about.
+
+        Membership is a Bitset, and keys are also bucketed by the timestep they were pooled at, like a timer wheel, so
+        rolling back or expiring a timestep only touches the keys pooled at that timestep. Keys expire once they have
+        been pooled for expiration timesteps, and when the pool holds more than capacity keys the oldest ones are
+        evicted. A pool that never expires or evicts only keeps the buckets that can still be rolled back.
+
+        The pool also journals which keys were added and removed since the last call to take_delta, so that reception
+        reports only need to carry the changes.
+        """
+        self.expiration: float = expiration
+        self.capacity: float = capacity
+        self.bounded: bool = expiration != float('inf') or capacity != float('inf')
+
+        self.members: Bitset = Bitset()
+        self.size: int = 0
+        # mapping of timestep to the keys pooled at that timestep, in the order they were pooled
+        self.buckets: dict[int, dict[int, None]] = {}
+        # heap of timesteps that have a bucket. Entries for buckets that have since been emptied are skipped lazily
+        self.bucket_times: list[int] = []
+
+        self.peak_size: int = 0
+        self.expired: int = 0
+        self.evicted: int = 0
+        self.rolled_back: int = 0
+
+        # net changes since the last take_delta. removed only holds keys that were pooled as of that call
+        self.added: Bitset = Bitset()
+        self.removed: Bitset = Bitset()
+
+    def add(self, key: int, timestep: int) -> None:
+        """
+        Pools key at timestep. A key that is already pooled keeps its original timestep.
+        """
+        if key in self.members:
+            return
+        if key in self.removed:
+            self.removed.discard(key)
+        else:
+            self.added.add(key)
+
+        self.members.add(key)
+        self.size += 1
+        if timestep not in self.buckets:
+            self.buckets[timestep] = {}
+            heapq.heappush(self.bucket_times, timestep)
+        self.buckets[timestep][key] = None
+
+        while self.size > self.capacity:
+            self.remove_oldest()
+            self.evicted += 1
+        self.peak_size = max(self.peak_size, self.size)
+
+    def remove(self, key: int) -> None:
+        """
+        Takes key out of the pool, without touching its bucket.
+        """
+        self.members.discard(key)
+        self.size -= 1
+        self.journal_removal(key)
+
+    def remove_oldest(self) -> None:
+        """
+        Removes the first key pooled at the oldest timestep.
+        """
+        timestep = self.get_oldest_timestep()
+        bucket = self.buckets[timestep]
+        key = next(iter(bucket))
+        del bucket[key]
+        if not bucket:
+            del self.buckets[timestep]
+        self.remove(key)
+
+    def get_oldest_timestep(self) -> int or None:
+        """
+        Returns the oldest timestep that still has a bucket, or None if there are none.
+        """
+        while self.bucket_times and self.bucket_times[0] not in self.buckets:
+            heapq.heappop(self.bucket_times)
+        return self.bucket_times[0] if self.bucket_times else None
+
+    def count_at(self, timestep: int) -> int:
+        """
+        Returns the number of keys pooled at timestep.
+        """
+        return len(self.buckets.get(timestep, ()))
+
+    def discard_timestep(self, timestep: int) -> None:
+        """
+        Removes every key pooled at timestep, e.g. to roll back packets that were lost to a collision.
+        """
+        bucket = self.buckets.pop(timestep, {})
+        for key in bucket:
+            self.remove(key)
+        self.rolled_back += len(bucket)
+
+    def expire(self, timestep: int) -> None:
+        """
+        Removes every key that, as of timestep, has been pooled for at least the expiration time.
+
+        If the pool is unbounded, nothing expires, but the buckets from before timestep are dropped since only the
+        current timestep can still be rolled back.
+        """
+        if not self.bounded:
+            while True:
+                oldest = self.get_oldest_timestep()
+                if oldest is None or oldest >= timestep:
+                    return
+                del self.buckets[oldest]
+
+        cutoff = timestep - self.expiration
+        while True:
+            oldest = self.get_oldest_timestep()
+            if oldest is None or oldest > cutoff:
+                return
+            bucket = self.buckets.pop(oldest)
+            for key in bucket:
+                self.remove(key)
+            self.expired += len(bucket)
+
+    def journal_removal(self, key: int) -> None:
+        """
+        Records that key has left the pool since the last take_delta.
+        """
+        if key in self.added:
+            self.added.discard(key)
+        else:
+            self.removed.add(key)
+
+    def take_delta(self) -> tuple[Bitset, Bitset]:
+        """
+        Returns the keys added to and removed from the pool since the last call, and starts a new journal.
+        """
+        delta = (self.added, self.removed)
+        self.added, self.removed = Bitset(), Bitset()
+        return delta
+
+    def has_delta(self) -> bool:
+        """
+        Returns True iff keys have been added or removed since the last take_delta
+        """
+        return bool(self.added or self.removed)
+
+    def get_members(self) -> Bitset:
+        """
+        Returns the bitset of pooled keys. Callers must copy it before keeping it.
+        """
+        return self.members
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns memory statistics for this pool: its current and peak number of keys, the number of timestep buckets
+        it holds, and how many keys have left it through expiry, eviction and rollback.
+        """
+        return {
+            'size': self.size,
+            'peak_size': self.peak_size,
+            'buckets': len(self.buckets),
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'rolled_back': self.rolled_back,
+        }
+
+    def __contains__(self, key: int) -> bool:
+        """
+        Returns True iff key is pooled
+        """
+        return key in self.members
+
+    def __len__(self) -> int:
+        """
+        Returns the number of pooled keys
+        """
+        return self.size
+
+    def __iter__(self):
+        """
+        Iterates over the pooled keys in increasing order
+        """
+        return iter(self.members)
+
+    def __repr__(self) -> str:
+        """
+        Returns PacketPool representation
+        """
+        return f'PacketPool({list(self.members)})'
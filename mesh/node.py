@@ -1,14 +1,32 @@
 import typing
 
+from common.events import EventCalendar
+from common.metrics import NetworkCounters, PacketMetrics
+from common.scheduler import RoundRobinScheduler
+from common.streams import RandomStreams
+
 from .packet import Packet
 from .link import Link
+from .packet_queue import PacketQueue
 
 
 class Node:
 
-    def __init__(self, mac_address: str, x: float, y: float, hierarchy_class: str, transmit_distance: float, response_wait_time: int) -> None:
+    def __init__(self, mac_address: str, x: float, y: float, hierarchy_class: str, transmit_distance: float, response_wait_time: int, queue_capacity: float = float('inf'), drop_policy: str = 'tail', red_params: dict = None, scheduler: RoundRobinScheduler = None, calendar: EventCalendar = None, streams: RandomStreams = None, counters: NetworkCounters = None) -> None:
         """
         Creates a node object
+
+        The node's queue holds at most queue_capacity packets, and drop_policy (with red_params passed on for 'red')
+        decides which packet is lost when it overflows. See PacketQueue for the policies.
+
+        If a scheduler is given, the node marks itself ready in it whenever a packet is queued. Responses are scheduled
+        in calendar, which is shared with the arena so that it can hand each response back through learn_timestep once
+        it is due. Without one, the node keeps a calendar of its own.
+
+        Link losses are drawn from the links stream of streams, and RED drops from its mac stream. Without streams,
+        both are drawn from the random module.
+
+        Queued packets, completed packets and link drops are also tracked in the network-wide counters, if given.
         """
         self.mac_address: str = mac_address
         self.x: float = x
@@ -17,24 +35,33 @@ class Node:
         self.transmit_distance: float = transmit_distance
         self.response_wait_time: int = response_wait_time
 
+        self.streams: RandomStreams = streams
         self.links: dict[str, Link] = {}
-        self.queue: list[tuple[Packet, int]] = []
-        self.waiting_for_response: dict[int, Packet] = {}
+        self.queue: PacketQueue = PacketQueue(
+            queue_capacity, drop_policy, **(red_params or {}), rng=None if streams is None else streams.mac)
+        self.scheduler: RoundRobinScheduler = scheduler
+        self.calendar: EventCalendar = EventCalendar() if calendar is None else calendar
 
         # metrics
-        self.sent: dict[int, int] = {}
-        self.received: dict[int, int] = {}
+        self.counters: NetworkCounters = NetworkCounters() if counters is None else counters
+        self.metrics: PacketMetrics = PacketMetrics(self.counters)
         self.received_packets = 0
+        self.link_drops = 0
 
-    def add_link(self, other: "Node") -> None:
+    def add_link(self, other: "Node", actual: float = None) -> None:
         """
         Adds a link from self to other.
+
+        If actual is given, it is taken as the distance between the two nodes instead of being recomputed.
         """
         distance = min(self.transmit_distance, other.get_transmit_distance())
-        other_x, other_y = other.get_position()
-        actual = ((self.x - other_x) ** 2 + (self.y - other_y) ** 2) ** 0.5
+        if actual is None:
+            other_x, other_y = other.get_position()
+            actual = ((self.x - other_x) ** 2 +
+                      (self.y - other_y) ** 2) ** 0.5
         if actual <= distance:
-            link = Link(self, other)
+            link = Link(self, other, actual,
+                        None if self.streams is None else self.streams.links)
             self.links[other.get_mac()] = link
         return
 
@@ -46,40 +73,45 @@ class Node:
             If yes, we are done. If no, enqueue a response packet and send back to original src.
         """
         # we are the final destination of a response packet
-        if packet.get_id() in self.sent or (not packet.get_is_request() and packet.get_path()[-1] == self.get_mac()):
-            self.received[packet.get_id()] = timestep
+        if self.metrics.is_in_flight(packet.get_id()) or (not packet.get_is_request() and packet.get_dst() == self.get_mac()):
+            self.metrics.record_received(packet.get_id(), timestep)
             self.received_packets += 1
         # we are generating the packet
-        elif packet.get_is_request() and packet.get_path()[0] == self.get_mac():
-            self.sent[packet.get_id()] = timestep
-            self.queue.append((packet, timestep))
+        elif packet.get_is_request() and packet.get_src() == self.get_mac():
+            self.metrics.record_sent(packet.get_id(), timestep)
+            self.push_to_queue((packet, timestep))
         # we are the final destination of request packet
-        elif packet.get_is_request() and packet.get_path()[-1] == self.get_mac():
-            self.waiting_for_response[timestep +
-                                      self.response_wait_time] = packet.get_reverse()
+        elif packet.get_is_request() and packet.get_dst() == self.get_mac():
+            self.calendar.schedule(timestep + self.response_wait_time,
+                                   self.mac_address, packet.get_reverse())
         # we are an intermediate node in a packet's path
         else:
-            self.queue.append((packet, timestep))
+            self.push_to_queue((packet, timestep))
         return
 
-    def learn_timestep(self, timestep: int) -> None:
+    def learn_timestep(self, timestep: int, responses: list[Packet] = ()) -> None:
         """
-        Tells this node the timestep that the arena is currently on. Updates the queue if it should
+        Tells this node the timestep that the arena is currently on, along with the responses it scheduled that are
+        now due. Each response is queued in the order it was scheduled.
         """
-        if timestep not in self.waiting_for_response:
-            return
-
-        response_packet = self.waiting_for_response.pop(timestep)
-        self.queue.append((response_packet, timestep))
+        for response_packet in responses:
+            self.push_to_queue((response_packet, timestep))
         return
 
+    def push_to_queue(self, entry: tuple[Packet, int]) -> None:
+        """
+        Pushes a (packet, timestep) entry onto the queue, and tells the scheduler this node has something to send.
+        """
+        if self.queue.push(entry) is None:
+            self.counters.queued += 1
+        if self.scheduler is not None:
+            self.scheduler.mark_ready(self.mac_address)
+
     def get_next_destination(self) -> str or None:
         """
         Returns the MAC address of the nexthop of the packet at the front of the queue.
         """
-        next_packet = self.queue[0][0]
-        packet_path = next_packet.get_path()
-        return packet_path[packet_path.index(self.mac_address) + 1]
+        return self.queue.peek()[0].get_nexthop(self.mac_address)
 
     def send_from_queue(self, timestep: int, hidden_terminal: bool, override: bool) -> Packet:
         """
@@ -88,11 +120,13 @@ class Node:
         If override, packet will always complete except if it's a hidden terminal
         """
         nexthop = self.get_next_destination()
-        packet = self.queue.pop(0)[0]
+        packet = self.queue.pop()[0]
+        self.counters.queued -= 1
         if hidden_terminal:
             return packet
-        self.links[nexthop].transmit(
-            packet, self.mac_address, timestep, override)
+        if not self.links[nexthop].transmit(packet, self.mac_address, timestep, override):
+            self.link_drops += 1
+            self.counters.link_drops += 1
         return packet
 
     def packet_in_queue(self) -> bool:
@@ -119,6 +153,18 @@ class Node:
         """
         return [p[0] for p in self.queue]
 
+    def get_queue_drops(self) -> int:
+        """
+        Returns the number of packets dropped because this node's queue was full
+        """
+        return self.queue.get_drops()
+
+    def get_link_drops(self) -> int:
+        """
+        Returns the number of packets this node sent that were lost on the link
+        """
+        return self.link_drops
+
     def get_packets_received(self) -> int:
         """
         Returns the number of packets that this node has received
@@ -158,17 +204,11 @@ class Node:
 
         return self.links[neighbor].get_probability()
 
-    def get_sent(self) -> dict[str, str]:
-        """
-        Return a dictionary of packets sent by this node and their timesteps
-        """
-        return {k: v for k, v in self.sent.items()}
-
-    def get_received(self) -> dict[str, str]:
+    def get_metrics(self) -> PacketMetrics:
         """
-        Return a dictionary of packets received by this node and their timesteps
+        Returns the metrics of the packets this node has sent
         """
-        return {k: v for k, v in self.received.items()}
+        return self.metrics
 
     def __str__(self) -> str:
         """
@@ -1,18 +1,24 @@
 from typing import Any
 
+from common.routing import Route
+
 class Packet:
     num_packets = 0
 
-    def __init__(self, is_request: bool, path_to_dst: list[str], packet_id: int = None) -> None:
+    def __init__(self, is_request: bool, path_to_dst: list[str] or Route, packet_id: int = None) -> None:
         """
         Creates a packet given a path to the destination MAC address and a packet size in bytes.
 
         Each packet also has packet_id, and notes whether it is a request for the destination or a response from the destination.
 
-        If no packet id supplied, sets to be the next packet id.
+        If no packet id supplied, sets to be the next packet id from a counter shared by the whole process. Arenas
+        allocate their own ids instead, so that they do not depend on each other.
+
+        The path can be given as a shared Route, in which case the packet just references it rather than copying it.
         """
         self.is_request = is_request
-        self.path_to_dst = path_to_dst[:]
+        self.route: Route = path_to_dst if isinstance(
+            path_to_dst, Route) else Route(tuple(path_to_dst))
         if packet_id is not None:
             self.packet_id = packet_id
         else:
@@ -23,7 +29,31 @@ class Packet:
         """
         Gets the packet's path to destination.
         """
-        return self.path_to_dst[:]
+        return list(self.route.hops)
+
+    def get_route(self) -> Route:
+        """
+        Gets the shared route this packet travels along.
+        """
+        return self.route
+
+    def get_src(self) -> str:
+        """
+        Gets the MAC address of the node this packet starts at.
+        """
+        return self.route.get_src()
+
+    def get_dst(self) -> str:
+        """
+        Gets the MAC address of this packet's destination.
+        """
+        return self.route.get_dst()
+
+    def get_nexthop(self, mac: str) -> str:
+        """
+        Gets the MAC address of the node after mac on this packet's path.
+        """
+        return self.route.get_nexthop(mac)
 
     def get_is_request(self) -> bool:
         """
@@ -42,7 +72,7 @@ class Packet:
         Returns a packet that is response of this packet.
         """
         assert self.is_request, 'can not get the reverse of a response packet'
-        return Packet(False, self.path_to_dst[::-1], self.packet_id)
+        return Packet(False, self.route.get_reverse(), self.packet_id)
 
     def __eq__(self, other: Any) -> bool:
         """
@@ -54,6 +84,6 @@ class Packet:
             return False
         if not self.is_request == other.is_request:
             return False
-        if not self.path_to_dst == other.path_to_dst:
+        if not self.route == other.route:
             return False
         return True
@@ -0,0 +1,102 @@
+import random
+from collections import deque
+from typing import Any
+
+DROP_POLICIES = ('tail', 'head', 'red')
+
+
+class PacketQueue:
+
+    def __init__(self, capacity: float = float('inf'), drop_policy: str = 'tail', min_threshold: float = None, max_threshold: float = None, max_probability: float = 0.1, weight: float = 0.002, rng: random.Random = None) -> None:
+        """
+        Creates a FIFO queue holding at most capacity entries, backed by a deque so both ends are O(1).
+
+        When a full queue is pushed to, drop_policy decides what is lost:
+            - 'tail' drops the arriving entry
+            - 'head' drops the oldest entry to make room for the arriving one
+            - 'red' is random early detection: arrivals are dropped with a probability that rises linearly from 0 to
+              max_probability as the moving average queue length goes from min_threshold to max_threshold, and always
+              once it passes max_threshold. A full queue still tail drops.
+
+        RED thresholds default to a quarter and three quarters of capacity, and weight is the gain of the moving
+        average. Its drops are drawn from rng, which defaults to the random module.
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(
+                f'unknown drop policy {drop_policy}, expected one of {DROP_POLICIES}')
+        if drop_policy == 'red' and capacity == float('inf') and (min_threshold is None or max_threshold is None):
+            raise ValueError('RED needs thresholds or a finite capacity')
+
+        self.entries: deque = deque()
+        self.capacity: float = capacity
+        self.drop_policy: str = drop_policy
+
+        self.min_threshold: float = capacity / 4 if min_threshold is None else min_threshold
+        self.max_threshold: float = 3 * capacity / 4 if max_threshold is None else max_threshold
+        self.max_probability: float = max_probability
+        self.weight: float = weight
+        self.average: float = 0
+        self.rng = random if rng is None else rng
+
+        self.drops: int = 0
+
+    def push(self, entry: Any) -> Any:
+        """
+        Appends entry to the back of the queue, subject to the drop policy.
+
+        Returns the entry that was dropped to make this push fit (which may be entry itself), or None if nothing was.
+        """
+        if self.drop_policy == 'red':
+            self.average += self.weight * (len(self.entries) - self.average)
+            if self.average >= self.max_threshold:
+                return self.drop(entry)
+            if self.average >= self.min_threshold:
+                drop_probability = self.max_probability * (self.average - self.min_threshold) / \
+                    (self.max_threshold - self.min_threshold)
+                if self.rng.random() < drop_probability:
+                    return self.drop(entry)
+
+        if len(self.entries) < self.capacity:
+            self.entries.append(entry)
+            return None
+        if self.drop_policy == 'head':
+            self.entries.append(entry)
+            return self.drop(self.entries.popleft())
+        return self.drop(entry)
+
+    def drop(self, entry: Any) -> Any:
+        """
+        Records that entry was dropped, and returns it.
+        """
+        self.drops += 1
+        return entry
+
+    def pop(self) -> Any:
+        """
+        Removes and returns the entry at the front of the queue.
+        """
+        return self.entries.popleft()
+
+    def peek(self) -> Any:
+        """
+        Returns the entry at the front of the queue without removing it.
+        """
+        return self.entries[0]
+
+    def get_drops(self) -> int:
+        """
+        Returns the number of entries this queue has dropped
+        """
+        return self.drops
+
+    def __len__(self) -> int:
+        """
+        Returns the number of entries in the queue
+        """
+        return len(self.entries)
+
+    def __iter__(self):
+        """
+        Iterates over the entries from front to back
+        """
+        return iter(self.entries)
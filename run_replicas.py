@@ -0,0 +1,206 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import argparse
+import json
+import math
+import os
+import statistics
+
+from run_simulate import PROTOCOLS, run_replica, topology_cache
+
+# two-sided 95% critical values of Student's t for 1 to 30 degrees of freedom. Past that the normal value is used
+T_CRITICAL_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+Z_CRITICAL_95 = 1.960
+
+
+def get_replica_key(topology_file, protocol, seed):
+    """
+    Returns the string identifying one replica in a results file.
+    """
+    return f'{topology_file}|{protocol}|{seed}'
+
+
+def load_records(output):
+    """
+    Returns the replica records in the JSONL file output, keyed by get_replica_key. A replica recorded more than once
+    keeps its latest record, and a truncated last line, left by a runner that was killed mid-write, is ignored.
+    """
+    records = {}
+    if not os.path.exists(output):
+        return records
+    with open(output, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[get_replica_key(record['topology'], record['protocol'], record['seed'])] = record
+    return records
+
+
+def run_batch(jobs, workers, on_result, function=run_replica):
+    """
+    Runs function, run_replica by default, on the arguments of each of the jobs, a mapping of names to tuples of
+    arguments, across a pool of workers, and calls on_result(name, result, error) as each one finishes. Returns the
+    names of the jobs that were lost because a worker process died.
+    """
+    lost = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(function, *args): name for name, args in jobs.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                lost.append(name)
+                continue
+            except Exception as e:
+                on_result(name, None, repr(e))
+                continue
+            on_result(name, result, None)
+    return lost
+
+
+def run_jobs(jobs, workers, on_result, function=run_replica):
+    """
+    Runs function, run_replica by default, on the arguments of each of the jobs, a mapping of names to tuples of
+    arguments, across a pool of worker processes, one per core by default, and calls on_result(name, result, error)
+    in this process as each one finishes, with either its result or the error it raised.
+
+    A worker process dying breaks its pool, losing every job that had not finished. The lost jobs are split in half
+    and each half is run again in a fresh pool, so the jobs that did not crash keep running in parallel, and only a
+    job that still loses its worker when run on its own is reported as failed.
+    """
+    workers = workers or os.cpu_count()
+    batches = [list(jobs)] if jobs else []
+    while batches:
+        names = batches.pop()
+        lost = run_batch({name: jobs[name] for name in names}, min(workers, len(names)), on_result, function)
+        if len(names) == 1 and lost:
+            on_result(names[0], None, 'worker process died')
+        elif lost:
+            half = (len(lost) + 1) // 2
+            batches += [lost[half:], lost[:half]] if len(lost) > 1 else [lost]
+
+
+def run_replicas(topology_files, protocols, seeds, timesteps, end_user_class, internet_enabled_class, output, simulate_kwargs=None, workers=None, cache_dir=topology_cache):
+    """
+    Runs a replica (see run_replica) for every topology file, protocol and seed in parallel with run_jobs, and
+    returns every record in output once they have all finished.
+
+    Each result is appended to the JSONL file output as soon as its replica finishes, as a record holding its
+    topology, protocol, seed and either its metrics or the error it raised. Replicas that already have metrics in
+    output are not run again, so an interrupted run picks up where it stopped.
+    """
+    for protocol in protocols:
+        if protocol not in PROTOCOLS:
+            raise ValueError(
+                f'unknown protocol {protocol}, expected one of {PROTOCOLS}')
+
+    done = {key for key, record in load_records(output).items() if 'metrics' in record}
+    replicas = {get_replica_key(topology_file, protocol, seed): (topology_file, protocol, seed)
+                for topology_file in topology_files for protocol in protocols for seed in seeds}
+    jobs = {key: replica + (timesteps, end_user_class, internet_enabled_class, simulate_kwargs, cache_dir)
+            for key, replica in replicas.items() if key not in done}
+
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'a') as f:
+        def write_record(key, metrics, error):
+            record = dict(zip(('topology', 'protocol', 'seed'), replicas[key]))
+            if error is None:
+                record['metrics'] = metrics
+            else:
+                record['error'] = error
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+
+        run_jobs(jobs, workers, write_record)
+
+    return list(load_records(output).values())
+
+
+def get_replica_values(metrics):
+    """
+    Reduces the summarized metrics of one replica to the scalars that are compared across replicas.
+    """
+    values = {
+        'overall_throughput': metrics['overall_throughput'],
+        'sending_nodes': len(metrics['messages_sent']),
+    }
+    if metrics['latencies']:
+        values['mean_latency'] = statistics.fmean(metrics['latencies'])
+    if 'coding_opps' in metrics:
+        values['coding_opps'] = sum(metrics['coding_opps'])
+    return values
+
+
+def get_confidence_interval(samples):
+    """
+    Returns the mean of samples and the half-width of its 95% confidence interval, which is infinite for a single
+    sample.
+    """
+    mean = statistics.fmean(samples)
+    if len(samples) < 2:
+        return mean, float('inf')
+    df = len(samples) - 1
+    critical = T_CRITICAL_95[df - 1] if df <= len(T_CRITICAL_95) else Z_CRITICAL_95
+    return mean, critical * statistics.stdev(samples) / math.sqrt(len(samples))
+
+
+def aggregate_replicas(records):
+    """
+    Groups the replica records that have metrics by topology and protocol, and returns, for every group, each
+    per-replica metric's mean, the half-width of its 95% confidence interval (ci95) and the number of replicas (n).
+    """
+    groups = {}
+    for record in records:
+        if 'metrics' not in record:
+            continue
+        group = groups.setdefault(f"{record['topology']}|{record['protocol']}", {})
+        for name, value in get_replica_values(record['metrics']).items():
+            group.setdefault(name, []).append(value)
+
+    aggregated = {}
+    for group, metrics in groups.items():
+        aggregated[group] = {}
+        for name, samples in metrics.items():
+            mean, ci95 = get_confidence_interval(samples)
+            aggregated[group][name] = {'mean': mean, 'ci95': ci95, 'n': len(samples)}
+    return aggregated
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs seeded replicas of mesh and COPE simulations in parallel, and reports means with 95% confidence intervals.')
+    parser.add_argument('topologies', nargs='*', default=['./topologies/cope_setup.json'])
+    parser.add_argument('--protocols', nargs='+', default=list(PROTOCOLS), choices=PROTOCOLS)
+    parser.add_argument('--seeds', type=int, default=10, help='number of seeds per topology and protocol')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--timesteps', type=int, default=100)
+    parser.add_argument('--end-user-class', default='type1')
+    parser.add_argument('--internet-enabled-class', default='type1')
+    parser.add_argument('--min-stream-size', type=int, default=1)
+    parser.add_argument('--max-stream-size', type=int, default=1)
+    parser.add_argument('--probability-send', type=float, default=.5)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per core by default')
+    parser.add_argument('--output', default='./simulation_results_final/replicas.jsonl')
+    args = parser.parse_args()
+
+    simulate_kwargs = {'min_stream_size': args.min_stream_size, 'max_stream_size': args.max_stream_size,
+                       'probability_send': args.probability_send}
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    records = run_replicas(args.topologies, args.protocols, seeds, args.timesteps, args.end_user_class,
+                           args.internet_enabled_class, args.output, simulate_kwargs, args.workers)
+
+    failed = [record for record in records if 'error' in record]
+    for record in failed:
+        print('failed', get_replica_key(record['topology'], record['protocol'], record['seed']), record['error'])
+    print(json.dumps(aggregate_replicas(records), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,24 @@
 from cope.arena import Arena as CopeArena
 from mesh.arena import Arena as MeshArena
 
+import contextlib
 import json
 import os
 import time
 
 # define topology here
 topology = "cope_setup.json"
+# compiled topologies are cached here, keyed by a hash of the topology file
+topology_cache = "./topologies/.compiled"
 
-def aggregate_metrics(metrics, is_cope, topology):
-    print(metrics)
+# the protocols a replica can simulate, and the arena that simulates each
+PROTOCOLS = ('mesh', 'cope')
+
+
+def summarize_metrics(metrics, is_cope):
+    """
+    Reduces the per-node metrics returned by Arena.simulate to the network-wide metrics that are saved for a run.
+    """
     for _, n in metrics.items():
         timesteps = n['timesteps']
         break
@@ -35,31 +44,63 @@ def aggregate_metrics(metrics, is_cope, topology):
     if is_cope:
         agg_metrics['coding_opps'] = [n['coding_opps_taken']
                                       for n in metrics.values() if n['coding_opps_taken'] != 0]
+    return agg_metrics
+
+
+def aggregate_metrics(metrics, is_cope, topology):
+    print(metrics)
+    agg_metrics = summarize_metrics(metrics, is_cope)
 
     cope_str = 'cope' if is_cope else 'mesh'
     with open(f'./simulation_results_final/{topology}/{cope_str}_metrics_{topology}.json', 'w') as f:
         json.dump(agg_metrics, f)
 
-exp_name = topology.split('.')[0] 
-if not os.path.exists('./simulation_results_final/' + exp_name):
-    os.makedirs('./simulation_results_final/' + exp_name)
 
-# make arenas
-mesh_arena = MeshArena(f"./topologies/{topology}")
-cope_arena = CopeArena(f"./topologies/{topology}")
+def run_replica(topology_file, protocol, seed, timesteps, end_user_class, internet_enabled_class, simulate_kwargs=None, cache_dir=topology_cache):
+    """
+    Simulates protocol (one of PROTOCOLS) on topology_file with the given seed, and returns the summarized metrics.
+
+    The arena's per-timestep progress output is discarded, and COPE nodes skip their invariant checks, since replicas
+    are meant to be run in bulk.
+    """
+    if protocol not in PROTOCOLS:
+        raise ValueError(
+            f'unknown protocol {protocol}, expected one of {PROTOCOLS}')
+    if protocol == 'cope':
+        arena = CopeArena(topology_file, cache_dir=cache_dir, validation='off', seed=seed)
+    else:
+        arena = MeshArena(topology_file, cache_dir=cache_dir, seed=seed)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        metrics = arena.simulate(
+            timesteps, end_user_class, internet_enabled_class, **(simulate_kwargs or {}))
+    return summarize_metrics(metrics, protocol == 'cope')
+
+
+def main():
+    exp_name = topology.split('.')[0]
+    if not os.path.exists('./simulation_results_final/' + exp_name):
+        os.makedirs('./simulation_results_final/' + exp_name)
+
+    # make arenas, sharing one compiled copy of the topology between them
+    mesh_arena = MeshArena(f"./topologies/{topology}", cache_dir=topology_cache)
+    cope_arena = CopeArena(f"./topologies/{topology}", cache_dir=topology_cache)
+
+    # define number of timesteps, sending nodes, receiving nodes, and optionally datastream size parameters and node sending probabilities here
+    mesh_metrics = mesh_arena.simulate(
+        100, 'type1', 'type1', probability_send=.5)
+    t = time.time()
 
-# define number of timesteps, sending nodes, receiving nodes, and optionally datastream size parameters and node sending probabilities here
-mesh_metrics = mesh_arena.simulate(
-    100, 'type1', 'type1', probability_send=.5)
-t = time.time()
+    aggregate_metrics(mesh_metrics, False, exp_name)
+    print('mesh time', time.time() - t)
 
-aggregate_metrics(mesh_metrics, False, exp_name)
-print('mesh time', time.time() - t)
+    t = time.time()
+    cope_metrics = cope_arena.simulate(
+        100, 'type1', 'type1', probability_send=.5)
 
-t = time.time()
-cope_metrics = cope_arena.simulate(
-    100, 'type1', 'type1', probability_send=.5)
+    aggregate_metrics(cope_metrics, True, exp_name)
+    print('cope time', time.time() - t)
 
-aggregate_metrics(cope_metrics, True, exp_name)
-print('cope time', time.time() - t)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+from run_replicas import get_confidence_interval, get_replica_values, run_jobs
+from run_simulate import PROTOCOLS, topology_cache
+
+# the root of the repository, and the paths in it whose code decides simulation results
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CODE_PATHS = ('common', 'mesh', 'cope', 'run_simulate.py')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    topology TEXT NOT NULL,
+    topology_name TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    code_version TEXT NOT NULL,
+    params TEXT NOT NULL,
+    metrics TEXT,
+    error TEXT,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_lookup ON results (topology_name, protocol, code_version);
+'''
+
+
+def get_code_version():
+    """
+    Returns a hash of the simulator's source code, so that results computed by different code are never mixed up.
+    """
+    digest = hashlib.sha256()
+    for path in CODE_PATHS:
+        full_path = os.path.join(ROOT, path)
+        if os.path.isfile(full_path):
+            files = [full_path]
+        else:
+            files = sorted(os.path.join(directory, name) for directory, _, names in os.walk(full_path)
+                           for name in names if name.endswith('.py'))
+        for file in files:
+            digest.update(os.path.relpath(file, ROOT).encode() + b'\0')
+            with open(file, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def hash_file(filename):
+    """
+    Returns the sha256 hex digest of the contents of filename.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_topology_name(topology_file):
+    """
+    Returns the name a topology file is queried by, e.g. 'nycmesh' for './topologies/nycmesh.json'.
+    """
+    return os.path.splitext(os.path.basename(topology_file))[0]
+
+
+def as_list(value):
+    """
+    Returns value if it is a list of grid values, or a list of just value otherwise.
+    """
+    return value if isinstance(value, list) else [value]
+
+
+def expand_sweep(spec):
+    """
+    Returns every point of the grid described by spec, a dict with:
+        - topologies: a topology file or list of them
+        - protocols: a subset of PROTOCOLS (both by default)
+        - seeds: the number of seeds per point, or a list of seeds (1 by default)
+        - timesteps: a value or list of values (100 by default)
+        - endUserClass and internetEnabledClass: the sending and receiving hierarchy classes ('type1' by default)
+        - simulate: Arena.simulate keyword arguments such as probability_send, each a value or list of values
+        - settings: topology settings such as responseWaitTime, each a value or list of values
+    Points whose min_stream_size is above their max_stream_size are left out.
+    """
+    seeds = spec.get('seeds', 1)
+    seeds = range(seeds) if isinstance(seeds, int) else seeds
+    protocols = as_list(spec.get('protocols', list(PROTOCOLS)))
+    for protocol in protocols:
+        if protocol not in PROTOCOLS:
+            raise ValueError(
+                f'unknown protocol {protocol}, expected one of {PROTOCOLS}')
+    simulate_grid = {name: as_list(values) for name, values in spec.get('simulate', {}).items()}
+    settings_grid = {name: as_list(values) for name, values in spec.get('settings', {}).items()}
+
+    points = []
+    for topology_file, protocol, timesteps in itertools.product(as_list(spec['topologies']), protocols, as_list(spec.get('timesteps', 100))):
+        for simulate_values in itertools.product(*simulate_grid.values()):
+            simulate = dict(zip(simulate_grid, simulate_values))
+            if simulate.get('min_stream_size', 1) > simulate.get('max_stream_size', 1):
+                continue
+            for settings_values in itertools.product(*settings_grid.values()):
+                for seed in seeds:
+                    points.append({
+                        'topology': topology_file,
+                        'protocol': protocol,
+                        'seed': seed,
+                        'timesteps': timesteps,
+                        'end_user_class': spec.get('endUserClass', 'type1'),
+                        'internet_enabled_class': spec.get('internetEnabledClass', 'type1'),
+                        'simulate': simulate,
+                        'settings': dict(zip(settings_grid, settings_values)),
+                    })
+    return points
+
+
+def get_point_params(point):
+    """
+    Returns the swept parameters of point as one flat dict, which is what queries select and filter on.
+    """
+    return {'timesteps': point['timesteps'], **point['simulate'], **point['settings']}
+
+
+def get_point_key(point, topology_digest, code_version):
+    """
+    Returns the cache key of point: a hash of everything that decides its result, namely the contents of the
+    topology it runs on (after settings are applied), the code version, and its protocol, seed and parameters.
+    """
+    content = {key: value for key, value in point.items() if key not in ('topology', 'settings')}
+    content['topology'] = topology_digest
+    content['code_version'] = code_version
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def make_topology_variant(topology_file, settings, directory):
+    """
+    Returns the path of a copy of topology_file with settings applied, written into directory the first time it is
+    asked for and named by a hash of its contents, keys sorted. Without settings, the file itself is returned.
+    """
+    if not settings:
+        return topology_file
+    with open(topology_file, 'r') as f:
+        data = json.load(f)
+    data.update(settings)
+    # written in the original key order, since the order of hierarchies and nodes decides the simulation
+    content = json.dumps(data)
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(directory, f'{get_topology_name(topology_file)}-{digest}.json')
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return path
+
+
+def open_store(db):
+    """
+    Opens the SQLite result store at db, creating it if it does not exist.
+    """
+    if os.path.dirname(db):
+        os.makedirs(os.path.dirname(db), exist_ok=True)
+    connection = sqlite3.connect(db)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def run_sweep(spec, db, workers=None, variant_dir=None, cache_dir=topology_cache):
+    """
+    Runs every point of the sweep spec (see expand_sweep) that the store at db has no result for, in parallel with
+    run_jobs, storing each result as soon as it finishes. Points are keyed by get_point_key, so an interrupted sweep
+    resumes where it stopped, and points shared with earlier sweeps are served from the store. Points that failed
+    before are run again.
+
+    Topologies with settings applied are written to variant_dir, by default next to db. Returns how many distinct
+    points the sweep has, and how many of them were cached, run and failed.
+    """
+    if variant_dir is None:
+        variant_dir = os.path.join(os.path.dirname(db), 'sweep_topologies')
+    code_version = get_code_version()
+    connection = open_store(db)
+    done = {key for key, in connection.execute('SELECT key FROM results WHERE metrics IS NOT NULL')}
+
+    digests = {}
+    points, jobs = {}, {}
+    for point in expand_sweep(spec):
+        topology_file = make_topology_variant(point['topology'], point['settings'], variant_dir)
+        if topology_file not in digests:
+            digests[topology_file] = hash_file(topology_file)
+        key = get_point_key(point, digests[topology_file], code_version)
+        if key in points:
+            continue
+        points[key] = point
+        if key not in done:
+            jobs[key] = (topology_file, point['protocol'], point['seed'], point['timesteps'], point['end_user_class'],
+                         point['internet_enabled_class'], point['simulate'], cache_dir)
+
+    failed = []
+
+    def store_result(key, metrics, error):
+        point = points[key]
+        connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            key, point['topology'], get_topology_name(point['topology']), point['protocol'], point['seed'], code_version,
+            json.dumps(get_point_params(point), sort_keys=True), None if metrics is None else json.dumps(metrics),
+            error, time.time()))
+        connection.commit()
+        if error is not None:
+            failed.append(key)
+
+    try:
+        run_jobs(jobs, workers, store_result)
+    finally:
+        connection.close()
+    return {'points': len(points), 'cached': len(points) - len(jobs), 'run': len(jobs), 'failed': len(failed)}
+
+
+def query(db, x, y, topology=None, protocol=None, where=None, code_version=None):
+    """
+    Returns how metric y (see get_replica_values, e.g. 'overall_throughput') varies with parameter x (e.g.
+    'probability_send') across the stored results: one dict per value of x, holding that value under x and the mean,
+    95% confidence interval half-width (ci95) and number (n) of the y values at it.
+
+    Results can be narrowed down to a topology, given by file or by name (e.g. 'nycmesh'), a protocol, and parameter
+    values in where, e.g. {'responseWaitTime': 2}. Only results from code_version count, which defaults to the
+    current code; pass '*' to use results from any version.
+
+    Only replicas that agree on everything but their seed are averaged together. If the results differ in other
+    parameters, or in topology or protocol when those are not given, there is a series for each combination of them,
+    whose values are included in each of its dicts. Series come one after another, each in increasing order of x.
+    """
+    if code_version is None:
+        code_version = get_code_version()
+    sql = 'SELECT topology_name, protocol, params, metrics FROM results WHERE metrics IS NOT NULL AND json_extract(params, ?) IS NOT NULL'
+    args = [f'$.{x}']
+    if topology is not None:
+        sql += ' AND (topology = ? OR topology_name = ?)'
+        args += [topology, topology]
+    if protocol is not None:
+        sql += ' AND protocol = ?'
+        args.append(protocol)
+    if code_version != '*':
+        sql += ' AND code_version = ?'
+        args.append(code_version)
+    for name, value in (where or {}).items():
+        sql += ' AND json_extract(params, ?) = ?'
+        args += [f'$.{name}', value]
+
+    connection = open_store(db)
+    try:
+        rows = connection.execute(sql, args).fetchall()
+    finally:
+        connection.close()
+
+    # mapping of the values of everything that was not fixed, other than x and seeds, to the samples at each x
+    samples = {}
+    for topology_name, row_protocol, params, metrics in rows:
+        value = get_replica_values(json.loads(metrics)).get(y)
+        if value is None:
+            continue
+        params = json.loads(params)
+        x_value = params.pop(x)
+        if topology is None:
+            params['topology'] = topology_name
+        if protocol is None:
+            params['protocol'] = row_protocol
+        group = tuple(sorted(params.items()))
+        samples.setdefault(group, {}).setdefault(x_value, []).append(value)
+
+    series = []
+    for group in sorted(samples, key=lambda group: [(name, type(value).__name__, value) for name, value in group]):
+        for x_value in sorted(samples[group]):
+            mean, ci95 = get_confidence_interval(samples[group][x_value])
+            series.append({**dict(group), x: x_value, 'mean': mean, 'ci95': ci95, 'n': len(samples[group][x_value])})
+    return series
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs parameter sweeps of mesh and COPE simulations into a result store, and queries it.')
+    parser.add_argument('--db', default='./simulation_results_final/sweeps.sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the points of a sweep that are not stored yet')
+    run_parser.add_argument('spec', help='JSON file describing the sweep grid')
+    run_parser.add_argument('--workers', type=int, default=None, help='worker processes, one per core by default')
+
+    query_parser = commands.add_parser('query', help='print how a metric varies with a parameter')
+    query_parser.add_argument('x', help='parameter, e.g. probability_send')
+    query_parser.add_argument('y', help='metric, e.g. overall_throughput')
+    query_parser.add_argument('--topology')
+    query_parser.add_argument('--protocol', choices=PROTOCOLS)
+    query_parser.add_argument('--where', type=json.loads, default=None,
+                              help='JSON object of parameter values to filter on')
+    query_parser.add_argument('--code-version', default=None, help="'*' for results from any code version")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        with open(args.spec, 'r') as f:
+            spec = json.load(f)
+        print(run_sweep(spec, args.db, args.workers))
+    else:
+        for row in query(args.db, args.x, args.y, args.topology, args.protocol, args.where, args.code_version):
+            group = ' '.join(f'{name}={value}' for name, value in row.items()
+                             if name not in (args.x, 'mean', 'ci95', 'n'))
+            print(f"{group}\t{row[args.x]}\t{row['mean']:.6g} ± {row['ci95']:.3g}\t(n={row['n']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+
+from common.metrics import LatencyHistogram, PacketMetrics
+from common.routing import RoutingEngine
+from common.scheduler import RoundRobinScheduler
+from common.spatial import SpatialGrid
+from common.streams import RandomStreams
+from common.timeseries import SERIES, TimeSeriesRecorder, read_timeseries
+from common.topology import ARRAYS, compile_topology, compute_contention, get_compiled_path, load_topology, parse_topology
+from common.traffic import BernoulliTraffic, OnOffTraffic, ParetoSizes, PoissonTraffic, TraceTraffic, TrafficModel, UniformSizes
+from cope.arena import Arena as CopeArena
+from mesh.arena import Arena as MeshArena
+from run_replicas import aggregate_replicas, run_jobs, run_replicas
+from run_sweep import expand_sweep, make_topology_variant, query, run_sweep
+
+
+def test_spatial_grid_query() -> None:
+    """
+    Tests that grid queries return every point within range, in insertion order.
+    """
+    random.seed(0)
+    grid = SpatialGrid(3)
+    points = [(random.uniform(-20, 20), random.uniform(-20, 20)) for _ in range(200)]
+    for i, (x, y) in enumerate(points):
+        grid.insert(x, y, i)
+    assert len(grid) == 200, 'expected every point to be in the grid'
+
+    for radius in [0.5, 3, 7.5, float('inf')]:
+        candidates = grid.query(1, -2, radius)
+        assert candidates == sorted(candidates), 'candidates should be in insertion order'
+        in_range = [i for i, (x, y) in enumerate(points)
+                    if ((x - 1) ** 2 + (y + 2) ** 2) ** 0.5 <= radius]
+        assert set(in_range) <= set(candidates), 'grid query missed a point within range'
+
+
+def test_compiled_topology() -> None:
+    """
+    Tests that a compiled topology reads back identically to the parsed JSON, and is only compiled once.
+    """
+    filename = './test_cope/test_arenas/wheel-top.json'
+    parsed = parse_topology(filename)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = compile_topology(filename, cache_dir)
+        assert path == get_compiled_path(filename, cache_dir)
+        modified = os.path.getmtime(path)
+        loaded = load_topology(filename, cache_dir)
+        assert os.path.getmtime(path) == modified, 'topology should not have been recompiled'
+
+        assert loaded.macs == parsed.macs
+        assert loaded.hierarchies == parsed.hierarchies
+        assert loaded.settings == parsed.settings
+        for name, _ in ARRAYS:
+            assert list(getattr(loaded, name)) == list(getattr(parsed, name)), name + ' differs after compiling'
+
+
+def test_routing_engine() -> None:
+    """
+    Tests that routes come from one tree per destination and maximize the product of link probabilities.
+    """
+    engine = RoutingEngine(parse_topology('./test_mesh/test_arenas/dfs.json'))
+    assert engine.get_path('n00', 'n33') == ['n00', 'n11', 'n22', 'n33'], 'shortest path is wrong'
+    assert engine.get_path('n30', 'n03') == ['n30', 'n21', 'n12', 'n03'], 'shortest path is wrong'
+    assert engine.get_path('n33', 'n33') == ['n33']
+    assert len(engine.trees) == 2, 'expected one tree per destination asked for'
+
+    engine.precompute(['n11'])
+    tree = engine.get_tree('n11')
+    assert engine.get_path('n00', 'n11') == ['n00', 'n11']
+    assert all(nexthop != -1 for nexthop in tree), 'every node in the grid can reach n11'
+
+    engine = RoutingEngine(parse_topology('./test_mesh/test_arenas/all-link-partitions.json'))
+    try:
+        engine.get_path('n1', 'n3')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('n1 should not be able to reach n3')
+
+
+def test_contention_graph() -> None:
+    """
+    Tests that the precomputed contention graph matches checking in_range between every pair of nodes.
+    """
+    for filename in ['./test_mesh/test_arenas/hidden-terminal.json', './topologies/cope_setup.json']:
+        topology = parse_topology(filename)
+        nodes = MeshArena(filename).get_nodes()
+        for index, mac in enumerate(topology.macs):
+            expected = [other for other, other_mac in enumerate(topology.macs) if other != index and (
+                nodes[mac].in_range(*nodes[other_mac].get_position()) or nodes[other_mac].in_range(*nodes[mac].get_position()))]
+            assert topology.get_contenders(index) == expected, f'wrong contenders for {mac}'
+
+    # short-range nodes mixed with a few long-range ones, which get grids of their own
+    rng = random.Random(3)
+    xs, ys = [rng.uniform(0, 100) for _ in range(300)], [rng.uniform(0, 100) for _ in range(300)]
+    transmit_distances = [rng.choice([0, 2, 5]) for _ in range(297)] + [40, 1e7, float('inf')]
+    indptr, indices = compute_contention(xs, ys, transmit_distances)
+    for index in range(len(xs)):
+        expected = [other for other in range(len(xs)) if other != index and ((xs[index] - xs[other]) ** 2 + (
+            ys[index] - ys[other]) ** 2) ** 0.5 <= max(transmit_distances[index], transmit_distances[other])]
+        assert indices[indptr[index]:indptr[index + 1]] == expected
+
+
+def test_round_robin_scheduler() -> None:
+    """
+    Tests that the scheduler keeps the fairness order of moving senders to the back, and only visits ready nodes.
+    """
+    scheduler = RoundRobinScheduler(['a', 'b', 'c', 'd'])
+    assert scheduler.get_ready(0) == ['a', 'b', 'c', 'd'], 'every node should start out ready'
+    scheduler.discard('a')
+    scheduler.discard('c')
+    scheduler.move_to_back('b')
+    scheduler.move_to_back('a')
+    assert scheduler.get_order() == ['c', 'd', 'b', 'a']
+    assert scheduler.get_ready(1) == ['d', 'b']
+
+    scheduler.wake_at('c', 3)
+    scheduler.wake_at('a', float('inf'))
+    assert scheduler.get_ready(2) == ['d', 'b']
+    assert scheduler.get_ready(3) == ['c', 'd', 'b'], 'c should be woken at timestep 3'
+
+    arena = MeshArena('./test_mesh/test_arenas/hidden-terminal.json')
+    arena.run()
+    assert not arena.scheduler.ready, 'nodes without packets should stop being visited'
+    arena.send_packet('n1', 'n2')
+    assert arena.scheduler.get_ready(arena.timestep) == ['n1']
+
+
+def test_traffic_generator() -> None:
+    """
+    Tests that drawing gaps between flows gives the same arrival rate as a coin flip per sender per timestep.
+    """
+    rng = random.Random(0)
+    senders = [f'u{i}' for i in range(50)]
+    traffic = BernoulliTraffic(senders, ['g1', 'g2'], 0.1, UniformSizes(1, 3), rng)
+    flows = []
+    for timestep in range(2000):
+        arrivals = traffic.pop_arrivals(timestep)
+        assert [senders.index(f[0]) for f in arrivals] == sorted(senders.index(f[0]) for f in arrivals), \
+            'flows should start in sender order'
+        assert len({f[0] for f in arrivals}) == len(arrivals), 'a sender starts at most one flow per timestep'
+        flows.extend(arrivals)
+    assert abs(len(flows) - 10000) < 500, 'expected about probability_send * senders * timesteps flows'
+    assert {f[1] for f in flows} == {'g1', 'g2'} and {f[2] for f in flows} == {1, 2, 3}
+
+    always = BernoulliTraffic(senders, ['g1'], 1, rng=rng)
+    assert len(always.pop_arrivals(0)) == 50 and len(always.pop_arrivals(1)) == 50
+    never = BernoulliTraffic(senders, ['g1'], 0, rng=rng)
+    assert never.next_arrival() == float('inf') and not never.pop_arrivals(100)
+
+
+def test_traffic_models() -> None:
+    """
+    Tests the arrival rates of the Poisson and on/off models, Pareto flow sizes, and streaming trace replay.
+    """
+    rng = random.Random(1)
+    senders = [f'u{i}' for i in range(20)]
+
+    poisson = PoissonTraffic(senders, ['g'], 0.5, rng=rng)
+    flows = [flow for timestep in range(1000) for flow in poisson.pop_arrivals(timestep)]
+    assert abs(len(flows) - 10000) < 500, 'expected about rate * senders * timesteps flows'
+
+    onoff = OnOffTraffic(senders, ['g'], 0.5, 10, 30, rng=rng)
+    flows = [flow for timestep in range(4000) for flow in onoff.pop_arrivals(timestep)]
+    assert abs(len(flows) - 10000) < 1000, 'senders should only be on a quarter of the time'
+
+    class Incomplete(TrafficModel):
+        def pop_arrivals(self, timestep: int) -> list[tuple[str, str, int]]:
+            return []
+    try:
+        Incomplete()
+        assert False, 'a model without next_arrival should not be created'
+    except TypeError:
+        pass
+
+    sizes = ParetoSizes(1.2, 2, 50)
+    draws = [sizes.draw(rng) for _ in range(5000)]
+    assert min(draws) == 2 and max(draws) == 50, 'sizes should be at least the scale and at most the cap'
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, opener in [('trace.csv', open), ('trace.csv.gz', gzip.open)]:
+            path = os.path.join(directory, name)
+            with opener(path, 'wt') as f:
+                f.write('# timestep,src,dst,size\n0,n1,n2,1\n0,n3,n2,2\n\n7,n1,n3,4\n')
+            trace = TraceTraffic(path)
+            assert trace.next_arrival() == 0
+            assert trace.pop_arrivals(0) == [('n1', 'n2', 1), ('n3', 'n2', 2)]
+            assert trace.next_arrival() == 7 and trace.pop_arrivals(6) == []
+            assert trace.pop_arrivals(7) == [('n1', 'n3', 4)]
+            assert trace.next_arrival() == float('inf')
+
+        arena = MeshArena('./test_mesh/test_arenas/hidden-terminal.json')
+        metrics = arena.simulate(10, 'type1', 'type1', traffic=TraceTraffic(path))
+        assert sum(node['successes'] + node['drops'] for node in metrics.values()) == 7, \
+            'every packet in the trace should have been sent'
+
+
+def test_seeded_arenas() -> None:
+    """
+    Tests that arenas with the same seed give identical results, even when run interleaved with other arenas.
+    """
+    streams = RandomStreams(4)
+    assert streams.traffic.random() != streams.links.random(), 'streams should be independent'
+    assert RandomStreams(4).get_stream('mac').random() == streams.mac.random()
+
+    for Arena in [MeshArena, CopeArena]:
+        first, other, second = (Arena('./topologies/cope_setup.json', seed=seed) for seed in [1, 2, 1])
+        results = []
+        for arena in [first, other, second]:
+            random.seed(arena.streams.get_seed() + 100)
+            results.append(arena.simulate(100, 'type1', 'type1', 1, 3, probability_send=0.05))
+        assert results[0] == results[2], 'the global random module should not affect seeded arenas'
+        assert results[0] != results[1]
+        assert first.num_packets == second.num_packets > 0, 'packet ids should be allocated per arena'
+
+
+def test_replica_runner() -> None:
+    """
+    Tests that replicas run in parallel are recorded as they finish, that failures are kept alongside them, and that a
+    rerun only runs the replicas that have no results yet.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'replicas.jsonl')
+        topologies = ['./topologies/cope_setup.json', './topologies/missing.json']
+        records = run_replicas(topologies, ['mesh', 'cope'], range(3), 50, 'type1', 'type1', output,
+                               {'probability_send': 0.2}, workers=2)
+        assert len(records) == 12
+        assert sum('error' in record for record in records) == 6, 'a missing topology should fail every replica'
+
+        aggregated = aggregate_replicas(records)
+        assert set(aggregated) == {'./topologies/cope_setup.json|mesh', './topologies/cope_setup.json|cope'}
+        throughput = aggregated['./topologies/cope_setup.json|cope']['overall_throughput']
+        assert throughput['n'] == 3 and throughput['mean'] > 0 and 0 <= throughput['ci95'] < float('inf')
+
+        with open(output) as f:
+            lines = len(f.readlines())
+        records = run_replicas(topologies[:1], ['mesh', 'cope'], range(4), 50, 'type1', 'type1', output,
+                               {'probability_send': 0.2}, workers=2)
+        with open(output) as f:
+            assert len(f.readlines()) == lines + 2, 'only the new seed should have been run'
+
+
+def sleep_or_crash(seconds: float) -> float:
+    """
+    Sleeps for seconds and returns them, or kills the worker process it runs in if seconds is negative.
+    """
+    if seconds < 0:
+        os._exit(1)
+    time.sleep(seconds)
+    return seconds
+
+
+def test_worker_crash() -> None:
+    """
+    Tests that a job that kills its worker is reported as failed, while the jobs it took down with it are rerun in
+    parallel and succeed.
+    """
+    jobs = {name: (0.5,) for name in range(8)}
+    jobs[3] = (-1,)
+    results = {}
+
+    def on_result(name, result, error):
+        assert name not in results, 'every job should be reported once'
+        results[name] = (result, error)
+
+    start = time.time()
+    run_jobs(jobs, 4, on_result, sleep_or_crash)
+    assert results == {name: (None, 'worker process died') if name == 3 else (0.5, None) for name in jobs}
+    assert time.time() - start < 0.5 * 7 * 0.8, 'the jobs that did not crash should not be rerun one at a time'
+
+
+def test_sweep() -> None:
+    """
+    Tests that a sweep stores every point of its grid, serves repeated points from the store, and can be queried.
+    """
+    spec = {'topologies': './test_mesh/test_arenas/hidden-terminal.json', 'protocols': ['mesh'], 'seeds': 2,
+            'timesteps': 40, 'simulate': {'probability_send': [0.1, 0.3], 'min_stream_size': [1, 2]},
+            'settings': {'responseWaitTime': [1, 3]}}
+    assert len(expand_sweep(spec)) == 2 * 2 * 2, 'min_stream_size 2 is above the default max_stream_size of 1'
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'sweeps.sqlite')
+        assert run_sweep(spec, db, workers=2) == {'points': 8, 'cached': 0, 'run': 8, 'failed': 0}
+
+        spec['simulate']['probability_send'].append(0.5)
+        assert run_sweep(spec, db, workers=2) == {'points': 12, 'cached': 8, 'run': 4, 'failed': 0}
+
+        series = query(db, 'probability_send', 'overall_throughput', topology='hidden-terminal', protocol='mesh')
+        assert [(row['responseWaitTime'], row['probability_send']) for row in series] == \
+            [(1, 0.1), (1, 0.3), (1, 0.5), (3, 0.1), (3, 0.3), (3, 0.5)], 'each response wait time is its own series'
+        assert all(row['n'] == 2 and 'topology' not in row for row in series)
+        assert series[3]['mean'] < series[5]['mean'], 'sending more should get more through'
+
+        series = query(db, 'probability_send', 'overall_throughput', where={'responseWaitTime': 3})
+        assert [row['probability_send'] for row in series] == [0.1, 0.3, 0.5]
+        assert all(row['protocol'] == 'mesh' and row['topology'] == 'hidden-terminal' for row in series)
+
+        series = query(db, 'responseWaitTime', 'overall_throughput', where={'probability_send': 0.3})
+        assert [(row['responseWaitTime'], row['n']) for row in series] == [(1, 2), (3, 2)]
+        assert query(db, 'probability_send', 'overall_throughput', protocol='cope') == []
+
+        original = './topologies/nycmesh.json'
+        variant = make_topology_variant(original, {'responseWaitTime': 1}, directory)
+        with open(original) as f, open(variant) as g:
+            assert json.load(f) == json.load(g)
+        assert parse_topology(variant).macs == parse_topology(original).macs, 'a variant should keep the node order'
+
+
+def test_checkpoints() -> None:
+    """
+    Tests that a simulation resumed from a checkpoint gives the same results as one that was never interrupted,
+    including traffic replayed from a trace, whether or not the traffic is passed again.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        trace = os.path.join(directory, 'trace.csv')
+        with open(trace, 'w') as f:
+            rng = random.Random(2)
+            for timestep in range(0, 150, 3):
+                f.write(f'{timestep},n{rng.randint(1, 5)},n{rng.randint(6, 10)},{rng.randint(1, 3)}\n')
+
+        path = os.path.join(directory, 'arena.ckpt')
+        for Arena in [MeshArena, CopeArena]:
+            for traffic in [None, trace]:
+                results = []
+                for checkpoint_path in [None, path]:
+                    arena = Arena('./topologies/cope_setup.json', seed=6)
+                    results.append(arena.simulate(150, 'type1', 'type1', 1, 3, probability_send=0.1,
+                                                  traffic=traffic and TraceTraffic(traffic),
+                                                  checkpoint_path=checkpoint_path, checkpoint_interval=130))
+                for passed in [None, traffic and TraceTraffic(traffic)]:
+                    resumed = Arena.load_checkpoint(path)
+                    assert 0 < resumed.timestep and resumed.traffic is not None
+                    assert traffic is None or resumed.timestep < 150, 'the trace should be checkpointed mid-replay'
+                    results.append(resumed.simulate(150, 'type1', 'type1', 1, 3, probability_send=0.1, traffic=passed))
+                assert all(result == results[0] for result in results), 'resuming should not change the results'
+
+        other_trace = os.path.join(directory, 'other.csv')
+        with open(other_trace, 'w') as f:
+            f.write('0,n1,n6,1\n')
+        try:
+            CopeArena.load_checkpoint(path).simulate(150, 'type1', 'type1', traffic=TraceTraffic(other_trace))
+            assert False, 'a different trace should not resume a checkpoint'
+        except ValueError:
+            pass
+
+        try:
+            MeshArena.load_checkpoint(path)
+            assert False, 'a COPE checkpoint should not load as a mesh arena'
+        except ValueError:
+            pass
+
+
+def test_streaming_metrics() -> None:
+    """
+    Tests that latency percentiles are exact for small latencies and close for large ones, and that packet metrics
+    only keep packets in flight.
+    """
+    rng = random.Random(8)
+    for high in [100, 100000]:
+        latencies = sorted(rng.randint(0, high) for _ in range(5000))
+        histogram = LatencyHistogram()
+        for latency in latencies:
+            histogram.add(latency)
+        assert histogram.get_mean() == sum(latencies) / len(latencies)
+        assert len(histogram.buckets) <= 128 * 11
+        for percentile in [50, 95, 99, 100]:
+            exact = latencies[-(-len(latencies) * percentile // 100) - 1]
+            assert abs(histogram.get_percentile(percentile) - exact) <= exact / 256
+
+    metrics = PacketMetrics()
+    for packet_id in range(3):
+        metrics.record_sent(packet_id, packet_id)
+    metrics.record_received(1, 11)
+    metrics.record_received(1, 20)
+    assert not metrics.is_in_flight(1) and len(metrics.in_flight) == 2
+    assert metrics.get_summary() == {'successes': 1, 'drops': 2, 'average_latency': 10, 'latency_p50': 10,
+                                     'latency_p95': 10, 'latency_p99': 10}
+
+    metrics = MeshArena('./topologies/cope_setup.json', seed=0).simulate(100, 'type1', 'type1', probability_send=0.1)
+    for node in metrics.values():
+        if node['successes'] > 0:
+            assert node['latency_p50'] <= node['latency_p95'] <= node['latency_p99'] < float('inf')
+
+
+def test_timeseries() -> None:
+    """
+    Tests that recorded time series add up to the end-of-run totals, and carry on from checkpoints unchanged,
+    whether or not the recorder is passed again.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'arena.ckpt')
+        for Arena in [MeshArena, CopeArena]:
+            arena = Arena('./topologies/cope_setup.json', seed=4)
+            metrics = arena.simulate(200, 'type1', 'type1', 1, 3, probability_send=0.2, checkpoint_path=path,
+                                     checkpoint_interval=60, recorder=TimeSeriesRecorder(directory, 7, buffer_rows=5))
+            series = read_timeseries(directory)
+            assert set(series) == set(SERIES)
+            assert all(len(column) == len(series['timestep']) for column in series.values())
+            assert list(series['timestep']) == sorted(set(series['timestep']))
+            assert series['timestep'][-1] == arena.timestep and series['queue_backlog'][-1] == 0
+            assert sum(series['completed']) == sum(node['successes'] for node in metrics.values())
+            assert sum(series['link_drops']) == sum(node['link_drops'] for node in metrics.values())
+            assert sum(series['senders']) == arena.counters.sends > sum(series['hidden_terminals'])
+            assert (sum(series['coded_packets']) > 0) == (Arena is CopeArena)
+            with open(os.path.join(directory, 'senders.npy'), 'rb') as f:
+                assert f.read(10) == b'\x93NUMPY\x01\x00\x76\x00'
+
+            for recorder in [None, TimeSeriesRecorder(directory, 7, buffer_rows=5)]:
+                resumed = Arena.load_checkpoint(path)
+                assert resumed.recorder is not None and resumed.timestep < arena.timestep
+                resumed.simulate(200, 'type1', 'type1', 1, 3, probability_send=0.2, recorder=recorder)
+                assert read_timeseries(directory) == series, 'resuming should not change the time series'
@@ -1,5 +1,12 @@
-from cope.arena import Arena
+import os
+import random
+
+from cope.arena import Arena, VALIDATION_ENV_VAR
+from cope.bitset import Bitset
+from cope.coding import CodingFinder, CODING_MODES
+from cope.node import VALIDATION_LEVELS
 from cope.packet import Packet
+from cope.packet_pool import PacketPool
 
 
 def get_packets_in_queues(queues: dict[str, Packet]):
@@ -266,3 +273,200 @@ def test_alice_and_bob() -> None:
     assert metrics['n1']['average_latency'] > 1 and metrics['n3']['average_latency'] > 1
     assert metrics['n1']['throughput'] <= 1 and metrics['n1']['throughput'] >= 0 and metrics['n3']['throughput'] <= 1 and metrics['n3']['throughput'] >= 0
     assert metrics['n2']['coding_opps_taken'] > 0
+
+
+def test_queue_heads() -> None:
+    """
+    Tests that the next destination is always the neighbor with the oldest queue head.
+    """
+    arena = Arena("./test_cope/test_arenas/wheel-top.json")
+    n1 = arena.get_nodes()['n1']
+    assert n1.get_next_destination() is None and not n1.packet_in_queues()
+
+    neighbors = list(n1.get_all_queues())
+    for timestep, neighbor in [(3, neighbors[0]), (1, neighbors[2]), (1, neighbors[1]), (2, neighbors[2])]:
+        n1.push_to_queue(neighbor, (Packet(True, ['n1', neighbor]), timestep))
+    assert n1.packet_in_queues()
+
+    # ties on age go to the neighbor that was linked first
+    order = []
+    while n1.packet_in_queues():
+        nexthop = n1.get_next_destination()
+        order.append((nexthop, n1.pop_from_queue(nexthop)[1]))
+    assert order == [(neighbors[1], 1), (neighbors[2], 1), (neighbors[2], 2), (neighbors[0], 3)]
+    assert n1.get_next_destination() is None
+
+
+def test_validation_levels() -> None:
+    """
+    Tests that validation can be picked per arena or from the environment, and never changes results.
+    """
+    metrics = {}
+    for level in VALIDATION_LEVELS:
+        random.seed(0)
+        arena = Arena("./test_cope/test_arenas/alice_and_bob.json", validation=level)
+        assert all(node.validation == level for node in arena.get_nodes().values())
+        metrics[level] = arena.simulate(100, 'type1', 'type1', probability_send=0.1)
+    assert metrics['off'] == metrics['cheap'] == metrics['full'], 'validation should not affect the simulation'
+
+    os.environ[VALIDATION_ENV_VAR] = 'off'
+    try:
+        arena = Arena("./test_cope/test_arenas/basic.json")
+        assert arena.get_nodes()['n1'].validation == 'off'
+    finally:
+        del os.environ[VALIDATION_ENV_VAR]
+    assert Arena("./test_cope/test_arenas/basic.json").get_nodes()['n1'].validation == 'full'
+
+    try:
+        Arena("./test_cope/test_arenas/basic.json", validation='sometimes')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected an unknown validation level to be rejected')
+
+
+def test_packet_pool() -> None:
+    """
+    Tests that the packet pool rolls back, expires and evicts packets by the timestep they were pooled at.
+    """
+    pool = PacketPool(expiration=3, capacity=4)
+    pool.add(1, 0)
+    pool.add(3, 1)
+    pool.add(5, 1)
+    pool.add(5, 1)
+    assert len(pool) == 3 and pool.count_at(1) == 2 and 5 in pool
+
+    pool.discard_timestep(1)
+    assert list(pool) == [1], 'rolling back a timestep should only remove its packets'
+
+    pool.add(6, 2)
+    pool.expire(2)
+    assert 1 in pool, 'packets should stay pooled for the expiration time'
+    pool.expire(3)
+    assert 1 not in pool and 6 in pool
+
+    for i in range(4, 8):
+        pool.add(2 * i + 1, 4)
+    assert len(pool) == 4 and 6 not in pool, 'the oldest packet should be evicted when over capacity'
+    assert pool.get_stats() == {'size': 4, 'peak_size': 4, 'buckets': 1,
+                                'expired': 1, 'evicted': 1, 'rolled_back': 2}
+
+    arena = Arena("./test_cope/test_arenas/wheel-top.json")
+    arena.send_packet('n1', 'n2')
+    arena.run()
+    stats = arena.get_packet_pool_stats()
+    assert stats['size'] == stats['peak_size'] == 5, 'every node should have pooled the one packet'
+
+
+def test_delta_reception_reports() -> None:
+    """
+    Tests that reception reports carry pool changes, and that applying them keeps neighbors in sync.
+    """
+    arena = Arena("./test_cope/test_arenas/alice_and_bob.json")
+    n1, n2 = arena.get_nodes()['n1'], arena.get_nodes()['n2']
+
+    n1.get_packet_pool().add(1, 0)
+    report = n1.make_reception_report(0, False)
+    assert not report.is_delta(), 'the first report should be a full one'
+    n2.receive_reception_report(report)
+    assert list(n2.neighbor_state['n1']) == [1]
+
+    n1.get_packet_pool().add(3, 1)
+    n1.get_packet_pool().add(4, 2)
+    n1.get_packet_pool().discard_timestep(0)
+    report = n1.make_reception_report(2, False)
+    assert report.is_delta()
+    assert list(report.get_packets()) == [3, 4] and list(report.get_removed_packets()) == [1]
+    n2.receive_reception_report(report)
+    assert n2.neighbor_state['n1'] == n1.get_packet_pool().get_members(), 'n2 should know exactly what n1 has'
+
+    assert n1.make_reception_report(3, False) is None, 'an idle node with no changes has nothing to report'
+    report = n1.make_reception_report(3, True)
+    assert report.is_delta() and not report.get_packets() and not report.get_removed_packets()
+    assert not n1.make_reception_report(16, False).is_delta(), 'a full report should be sent to resync'
+
+    # resyncs fall on multiples of the interval, however out of step the nodes' first reports were
+    assert not n2.make_reception_report(5, True).is_delta() and n2.make_reception_report(15, True).is_delta()
+    assert not n2.make_reception_report(16, True).is_delta()
+    assert (32, 'n1') in arena.scheduler.wakeups and (32, 'n2') in arena.scheduler.wakeups
+
+
+def test_bitset() -> None:
+    """
+    Tests that bitsets behave like sets of packet keys, including across chunk boundaries.
+    """
+    keys = [0, 5, 511, 512, 100000]
+    bitset = Bitset(keys)
+    assert list(bitset) == keys and len(bitset) == 5
+    assert 511 in bitset and 510 not in bitset and 2 ** 40 not in bitset
+
+    other = bitset.copy()
+    other.discard(512)
+    other.discard(513)
+    assert 512 in bitset and 512 not in other and len(other) == 4
+
+    other |= Bitset([1, 512, 513])
+    other -= Bitset([0, 100000, 7])
+    assert list(other) == [1, 5, 511, 512, 513]
+    other -= other.copy()
+    assert not other and other == Bitset() and not other.chunks, 'empty chunks should be dropped'
+
+    assert Packet(True, ['n1', 'n2'], 3).get_key() == 7
+    assert Packet(True, ['n1', 'n2'], 3).get_reverse().get_key() == 6
+
+
+def test_coding_modes() -> None:
+    """
+    Tests that greedy coding takes compatible neighbors in queue order, while exact coding finds the largest set.
+    """
+    heads = {'f': 0, 'a': 2, 'b': 4, 'c': 6}
+    # a knows the heads of f only, while b and c know each other's
+    neighbor_state = {'f': Bitset([2, 4, 6]), 'a': Bitset([0]),
+                      'b': Bitset([0, 6]), 'c': Bitset([0, 4])}
+    assert CodingFinder('greedy').find('f', heads, neighbor_state) == ['f', 'a']
+    assert CodingFinder('exact').find('f', heads, neighbor_state) == ['f', 'b', 'c']
+    assert CodingFinder('exact', exact_limit=2).find('f', heads, neighbor_state) == ['f', 'a'], \
+        'exact coding should fall back to greedy for large degrees'
+
+    neighbor_state['a'] = Bitset([0, 4, 6])
+    neighbor_state['b'].add(2)
+    neighbor_state['c'].add(2)
+    for mode in CODING_MODES:
+        assert CodingFinder(mode).find('f', heads, neighbor_state) == ['f', 'a', 'b', 'c']
+
+    # neighbors that know many other packets code the same way, and their states are left alone
+    neighbor_state = {neighbor: Bitset(range(0, 10000, 2)) for neighbor in heads}
+    neighbor_state['a'].discard(4)
+    assert CodingFinder('greedy').find('f', heads, neighbor_state) == ['f', 'a', 'c']
+    assert len(neighbor_state['f']) == 5000 and 4 not in neighbor_state['a']
+
+
+def test_event_driven_simulation() -> None:
+    """
+    Tests that skipping idle timesteps and nodes gives the same results as stepping through every one.
+    """
+    results = []
+    for event_driven in [True, False]:
+        random.seed(5)
+        arena = Arena("./topologies/cope_setup.json")
+        results.append(arena.simulate(200, 'type1', 'type1', 1, 3, probability_send=0.02,
+                                      event_driven=event_driven))
+    assert results[0] == results[1], 'event driven simulation should match the time-stepped one'
+    assert sum(node['successes'] for node in results[0].values()) > 0
+
+
+def test_broadcast() -> None:
+    """
+    Tests that a broadcast draws the same outcomes as transmitting over each link in turn, and reaches every neighbor
+    on override.
+    """
+    arena = Arena('./test_cope/test_arenas/wheel-top.json')
+    hub = max(arena.get_nodes().values(), key=lambda node: len(node.links))
+    assert len(hub.links) > 1
+
+    state = hub.rng.getstate()
+    expected = [arena.get_nodes()[mac] for mac, link in hub.links.items()
+                if hub.rng.random() < link.get_probability()]
+    hub.rng.setstate(state)
+    assert hub.broadcast(False) == expected
+    assert [node.get_mac() for node in hub.broadcast(True)] == list(hub.links)
@@ -1,5 +1,8 @@
+import random
+
 from mesh.arena import Arena
 from mesh.packet import Packet
+from mesh.packet_queue import PacketQueue
 
 
 def test_parse() -> None:
@@ -242,11 +245,113 @@ def test_sim_hidden_terminals() -> None:
     """
     Test simulation and metrics getting for the hidden terminals example.
     """
-    arena = Arena("./test_mesh/test_arenas/hidden-terminal.json")
+    arena = Arena("./test_mesh/test_arenas/hidden-terminal.json", seed=0)
 
     metrics = arena.simulate(100, 'type1', 'type1', probability_send=0.1)
 
     for _, node in metrics.items():
         assert node['average_latency'] > 1
         assert node['throughput'] <= 1 and node['throughput'] >= 0
-        assert node['drops'] > 0
\ No newline at end of file
+        assert node['drops'] > 0
+
+
+def test_probability_matrix() -> None:
+    """
+    Tests that the precomputed link probabilities match the distances between nodes.
+    """
+    arena = Arena("./test_mesh/test_arenas/dfs.json")
+    node_mapping = arena.get_nodes()
+    n00 = node_mapping['n00']
+    assert n00.get_probability('n11') == 1 - 0.8 * 2 ** 0.5 / 1.5
+    assert n00.get_probability('n01') == 1 - 0.8 / 1.5
+    assert n00.get_probability('n22') == 0, 'n00 and n22 are not linked'
+
+    macs, matrix = arena.get_probability_matrix()
+    assert len(macs) == 16 and all(len(row) == 16 for row in matrix)
+    for i, mac in enumerate(macs):
+        for j, other in enumerate(macs):
+            assert matrix[i][j] == node_mapping[mac].get_probability(other)
+            assert matrix[i][j] == matrix[j][i], 'link probabilities should be symmetric'
+
+
+def test_shared_routes() -> None:
+    """
+    Tests that packets reference a shared route instead of copying their path, and look up nexthops from it.
+    """
+    arena = Arena('./test_mesh/test_arenas/dfs.json')
+    n00 = arena.get_nodes()['n00']
+    arena.send_packet('n00', 'n33')
+    arena.send_packet('n00', 'n33')
+    first, second = n00.get_queue_state()
+    assert first.get_route() is second.get_route(), 'packets between the same nodes should share a route'
+    assert first.get_id() != second.get_id()
+
+    assert first.get_src() == 'n00' and first.get_dst() == 'n33'
+    assert first.get_nexthop('n00') == 'n11' and first.get_nexthop('n22') == 'n33'
+    assert n00.get_next_destination() == 'n11'
+
+    reverse = first.get_reverse()
+    assert reverse.get_route() is first.get_reverse().get_route(), 'reversed routes should be shared too'
+    assert reverse.get_path() == ['n33', 'n22', 'n11', 'n00']
+
+
+def test_queue_drop_policies() -> None:
+    """
+    Tests that bounded queues drop the right packets under each policy.
+    """
+    tail = PacketQueue(2, 'tail')
+    head = PacketQueue(2, 'head')
+    for i in range(4):
+        tail.push(i)
+        head.push(i)
+    assert list(tail) == [0, 1] and tail.get_drops() == 2, 'tail drop should keep the oldest entries'
+    assert list(head) == [2, 3] and head.get_drops() == 2, 'head drop should keep the newest entries'
+    assert tail.pop() == 0 and len(tail) == 1
+
+    red = PacketQueue(100, 'red', max_probability=0, weight=1)
+    for i in range(100):
+        red.push(i)
+    assert len(red) == 75, 'RED should drop everything once the average passes the max threshold'
+    assert red.get_drops() == 25
+
+    unbounded = PacketQueue()
+    for i in range(1000):
+        assert unbounded.push(i) is None
+    assert unbounded.get_drops() == 0
+
+    arena = Arena("./test_mesh/test_arenas/hidden-terminal.json")
+    metrics = arena.simulate(20, 'type1', 'type1', probability_send=0.1)
+    for node in metrics.values():
+        assert node['queue_drops'] == 0, 'queues are unbounded unless the topology says otherwise'
+        assert node['link_drops'] >= 0
+
+
+def test_event_driven_simulation() -> None:
+    """
+    Tests that skipping idle timesteps gives the same results as stepping through every one.
+    """
+    results = []
+    for event_driven in [True, False]:
+        random.seed(5)
+        arena = Arena("./topologies/cope_setup.json")
+        results.append(arena.simulate(200, 'type1', 'type1', 1, 3, probability_send=0.02,
+                                      event_driven=event_driven))
+    assert results[0] == results[1], 'event driven simulation should match the time-stepped one'
+
+
+def test_response_timers() -> None:
+    """
+    Tests that responses are fired by the arena once due, including several for the same node and timestep.
+    """
+    arena = Arena("./test_mesh/test_arenas/hidden-terminal.json")
+    n2 = arena.get_nodes()['n2']
+    n2.enqueue_packet(Packet(True, ['n1', 'n2'], 100), 0)
+    n2.enqueue_packet(Packet(True, ['n3', 'n2'], 101), 0)
+    assert not n2.packet_in_queue() and arena.calendar.next_timestep() == 1
+
+    arena.run()
+    assert not n2.packet_in_queue(), 'responses should wait for the response wait time'
+    arena.run()
+    assert [packet.get_id() for packet, _ in n2.queue] == [100, 101], 'both responses should be queued'
+    assert [packet.get_dst() for packet, _ in n2.queue] == ['n1', 'n3']
+    assert len(arena.calendar) == 0